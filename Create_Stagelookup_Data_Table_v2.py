@@ -61,6 +61,7 @@
 #                     5-m DEM      0.10 ft                           411                                  13,974          0.8 hrs
 #                     5-m DEM      0.01 ft                          4101                                 139,434          8.2 hrs
 #                 Note that it did not appear to take longer if messages were output to the screen for each iteration.
+#                 The same matrix can be run without ArcGIS, on synthetic DEMs, with ShorelineTools/stagelookup_benchmark.py.
 #
 ######################################################################################################################################
 #
@@ -116,6 +117,8 @@
 
 # Import system modules.
 import sys, os, time, arcpy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ShorelineTools"))
+import stagelookup_engine, stagelookup_run, stagelookup_adaptive, stagelookup_cache
 arcpy.CheckOutExtension("3D") # Check out 3D extension license
 
 starttime = time.clock() 
@@ -143,6 +146,21 @@ incElev_feet = float(arcpy.GetParameterAsText(7))
 numDecimals = int(arcpy.GetParameterAsText(8))        
 zFact = float(arcpy.GetParameterAsText(9))
 refPlane = arcpy.GetParameterAsText(10) 
+# Optional parameters: the script tool in Shoreline Management Tool.tbx defines only parameters 0 to 10 above,
+#    so the ones it does not pass take their default values (see stagelookup_run.optional_parameter).
+engine = stagelookup_run.optional_parameter(11, "NUMPY")
+workers = stagelookup_run.resolve_workers(stagelookup_run.optional_parameter(12))
+resume = stagelookup_run.optional_parameter(13).lower() == "true"
+tile_mb = float(stagelookup_run.optional_parameter(14, stagelookup_engine.DEFAULT_TILE_MB))
+inZonalDEM = stagelookup_run.optional_parameter(15)
+inParcelRaster = stagelookup_run.optional_parameter(16)
+binary_store = stagelookup_run.optional_parameter(17).lower() == "true"
+tolerance = float(stagelookup_run.optional_parameter(18, stagelookup_adaptive.DEFAULT_TOLERANCE))
+cache_folder = stagelookup_run.optional_parameter(19)
+cache_mb = float(stagelookup_run.optional_parameter(20, stagelookup_cache.DEFAULT_CACHE_MB))
+outDatum2 = stagelookup_run.optional_parameter(21)
+datum_offset = stagelookup_run.optional_parameter(22)
+compress = stagelookup_run.optional_parameter(23).lower() == "true"
 
 
 ### *************************************************** USER-DEFINED VARIABLES *******************************************************
@@ -184,6 +202,42 @@ refPlane = arcpy.GetParameterAsText(10)
 # ###                         #             See help for SurfaceVolume_3d if DEM ground and elevation units are different.
 # refPlane        = "BELOW"   # String:  Set to ABOVE or BELOW, see the help for SurfaceVolume_3d.
 # ###                         #             (selects whether to calculate area & volume above or below given reference plane elev).
+# engine          = "NUMPY"   # String:  Stage-volume engine, NUMPY, SURFACEVOLUME or ADAPTIVE (optional, default NUMPY).
+# ###                         #             NUMPY reads each DEM once and computes every stage in one sweep;
+# ###                         #             SURFACEVOLUME runs SurfaceVolume_3d once per stage increment;
+# ###                         #             ADAPTIVE runs SurfaceVolume_3d only at the stages needed to meet "tolerance".
+# workers         = 1         # Integer: Number of parallel worker processes (optional, default 1 = serial; 0 = one per CPU).
+# resume          = False     # Boolean: Resume an interrupted run from its journal (optional, default False).
+# ###                         #             The journal StageLookup<datum>.txt.journal is written next to the output file;
+# ###                         #             a resumed run must use the same input parameters as the interrupted one.
+# tile_mb         = 256       # Float:   Memory budget, in megabytes, for one tile of a DEM read by the NUMPY engine (optional).
+# ###                         #             DEMs are read tile by tile, so DEMs larger than RAM can be used;
+# ###                         #             a parallel run uses up to "workers" times this budget.
+# inZonalDEM      = ""        # String:  Zonal mode (optional): one valley-wide DEM used for every parcel.
+# inParcelRaster  = ""        # String:  Zonal mode (optional): raster co-registered with inZonalDEM (same extent and cell size)
+# ###                         #             whose cell values are the parcel number (PARC_NUMBER) of each cell.
+# ###                         #             When set, the input list of DEMs is not used; all parcels are computed in one read
+# ###                         #             of the DEM and written in order of increasing parcel number (NUMPY engine, serial).
+# ###                         #             Both rasters are required; engine, workers and cache_folder are ignored (with a warning).
+# binary_store    = False     # Boolean: Also write the indexed binary store StageLookup<datum>.bin (optional, default False).
+# ###                         #             Read it with stagelookup_store.StageLookupStore for direct (parcel, stage) lookups;
+# ###                         #             StageLookupStore.export_text() writes the text format again.
+# tolerance       = 0.001     # Float:   ADAPTIVE engine interpolation tolerance, in acres and acre-feet (optional, default 0.001).
+# ###                         #             Stages between SurfaceVolume_3d samples are interpolated; sampling is refined
+# ###                         #             until every interpolated area and volume is bounded to within this tolerance.
+# cache_folder    = ""        # String:  Folder of the result cache (optional, default no cache).
+# ###                         #             Per-parcel results are kept there, keyed by DEM content, zFact and refPlane;
+# ###                         #             a re-run computes only changed parcels and stages not computed before.
+# cache_mb        = 1024      # Float:   Size limit of the result cache, in megabytes (optional, default 1024).
+# ###                         #             Least recently used entries are removed at the end of a run.
+# outDatum2       = ""        # String:  Second vertical datum to write from the same run, such as NGVD29 (optional).
+# ###                         #             StageLookup<outDatum2>.txt is written next to StageLookup<inDEMdatum>.txt.
+# datum_offset    = 0.0       # String:  Offset, in ft, from the DEM datum to outDatum2 (elev_outDatum2 = elev_DEM + offset):
+# ###                         #             one number, or the path of a "parc_number,offset_feet" file for per-parcel offsets
+# ###                         #             (required when outDatum2 is set; there is no default offset).
+# compress        = False     # Boolean: Write the output file(s) gzip compressed, as StageLookup<datum>.txt.gz (optional, default False).
+# ###                         #             Smaller files for network shares; decompress (gzip -d) to StageLookup<datum>.txt
+# ###                         #             for the Shoreline Management Tool.  The decompressed file is the same as an uncompressed run.
 ###
 ###
 ### End Setting Variables (user should not normally need to modify script below this point).
@@ -193,138 +247,11 @@ refPlane = arcpy.GetParameterAsText(10)
 
 
 
-# Prepare output file.
-# RYAN COMMENT - Put check to see if file exists in folder.
-outFile_name   = "StageLookup" + inDEMdatum + ".txt"          # Name of output text file of elevation, area, and volume .
-#                                                             #    WARNING: will overwrite existing file.
-#                                                             # The required naming convention for the data table files are 
-#                                                             #    StageLookupNAVD88.txt or StageLookupNGVD29.txt, depending on 
-#                                                             #    vertical datum used, NAVD88 or NGVD 29, respectively. 
-outFile        = os.path.join(out_folder_path,outFile_name)   # Full path and file name of output file.
-# Open listing file.
-#
-output = open(outFile,"w")
-
-# Check file.
-#
-if output is None:
-   arcpy.AddMessage("%s %s" % ("Error: Unable to open output file ",output_file))
-   sys.exit( 1 )
-
-# Write to screen the parameters specified for the run.
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-arcpy.AddMessage("%s" % ("USER-SPECIFIED INPUT PARAMETERS:"))
-arcpy.AddMessage("%s %s" % ("   Path to folder with file of input list of DEMs (inDEM_list_path)     =", inDEM_list_path))
-arcpy.AddMessage("%s %s" % ("   Filename of input list of DEMs                 (inDEM_list_name)     =", inDEM_list_name))
-arcpy.AddMessage("%s %s" % ("   Path to input DEMs                             (inDEMpath)           =", inDEMpath))
-arcpy.AddMessage("%s %s" % ("   Vertical datum of input DEMs: NAVD88 or NGVD29 (inDEMdatum)          =", inDEMdatum))
-arcpy.AddMessage("%s %s" % ("   Path to output folder for output text file     (out_folder_path)     =", out_folder_path))
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-arcpy.AddMessage("%s %f" % ("   Starting Elevation, in ft          (startElev_feet) =", startElev_feet))
-arcpy.AddMessage("%s %f" % ("   Ending   Elevation, in ft          (endElev_feet)   =", endElev_feet))
-arcpy.AddMessage("%s %f" % ("   Increment, in ft                   (incElev_feet)   =", incElev_feet))
-arcpy.AddMessage("%s %i" % ("   Num. decimals to round elev, in ft (numDecimals)    =", numDecimals))
-arcpy.AddMessage("%s %f" % ("   Z-Factor                           (zFact)          =", zFact))
-arcpy.AddMessage("%s %s" % ("   Reference Plane                    (refPlane)       =", refPlane))
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-
-inDEM_list_fullpath  = os.path.join(inDEM_list_path,inDEM_list_name)
-arcpy.AddMessage("%s %s" % ("   Full path and filename of input list of DEMs (inDEM_list_fullpath) =", inDEM_list_fullpath))
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-inDEM_list       = file(inDEM_list_fullpath, "r" )
-
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-arcpy.AddMessage("%s %s" % ("Output file location:", outFile))   # Print output file location to screen.
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-
-# Write output file header info with column names.
-output.write("%s%s%s  %s,  %s,  %s,  %s,  %s,  %s\r\n" % ("Input DEM list=  ",inDEM_list_fullpath,";  Columns= ","parc_number",\
-   "refElev_feet","not_used", "not_used", "Volume_acft", "2D_Area_ac"))
-
-# Write screen header info with column names (the lines below may be commented out if screen display is not needed).
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-arcpy.AddMessage("%s" % ("OUTPUT COLUMNS:"))
-arcpy.AddMessage("%s, %s, %s, %s, %s, %s" % ("parcel_number","refElev_feet","not_used","not_used", "Volume_acre-feet","2D_Area_acres")) #RYAN switch 4th & 5th column
-#arcpy.AddMessage("%s, %s, %s, %s, %s, %s" % ("parcel_number","refElev_feet","not_used","Volume_acre-feet","not_used","2D_Area_acres"))
-
-# Round increment to user-specified number of decimals to prevent deviations due to floating point values.
-incElev_feet = round(incElev_feet,numDecimals)
-
-# Iterate through all the DEMs in inDEMList.
-for aLine in inDEM_list:
-
-    if len(aLine) < 1:
-        break
-    parc_numSTR, inDEMname = aLine.split( "," )
-    inDEM = os.path.join(inDEMpath,inDEMname)
-    if parc_numSTR is None or parc_numSTR == "":
-        break
-    arcpy.AddMessage("")  #space out screen messages
-    arcpy.AddMessage("")  #space out screen messages
-    arcpy.AddMessage("%s, %s" % ("Parcel Number= " + parc_numSTR,"Input DEM= "+ inDEM))
-    parc_number = int(parc_numSTR)
-
-
-    # Initialize reference plane elevation (in feet) and round to user-specified number of decimals.
-    refElev_feet = round(startElev_feet,numDecimals)   # Round to prevent deviations due to using floating point values.
- 
-    # Loop through elevations incrementally to calculate area and volume, writing results to screen and text file.
-    #
-    try:
-        # Return a new output for every change of incElev elevation unit.
-        # SurfaceVolume appends data if the file exists already.
-        #
-        while refElev_feet <= endElev_feet:
-            refElev_meters = refElev_feet/3.280833        # Reference plane elevation converted to meters.
-            #
-            arcpy.env.overwriteOutput = True              # Needed to append each new record to the output file.
-
-            # Run the SurfaceVolume_3d program with the user-defined values.
-            #
-            arcpy.SurfaceVolume_3d(inDEM, "", refPlane, refElev_meters, zFact)
- 
-            # Obtain the values or 2D Area, 3D Area, and Volume reported by SurfaceVolume_3d
-            #    by searching through the output message results string.
-            #
-            r = arcpy.GetMessage(2)
-            area2d_m2 = float(r[r.find("2D Area=") + 8:r.find("3D Area=")])
-            area3d_m2 = float(r[r.find("3D Area=") + 8:r.find("Volume=")])
-            vol3d_m3  = float(r[r.find("Volume=")+7:])
-
-            # Convert from units of square meters and cubic meters to acres and acre-ft, respectively
-            area2d_ac    = area2d_m2 / 4046.873
-            area3d_ac    = area3d_m2 / 4046.873
-            vol3d_acft   = vol3d_m3  / 1233.489
-     
-            # Report the input and output values to the screen.
-
-            arcpy.AddMessage("%i,  %f,  %s,  %f,  %s,  %f" % (parc_number,refElev_feet,"not_used","not_used",vol3d_acft,area2d_ac)) # RYAN fix, switch 4th & 5th columns
-            #arcpy.AddMessage("%i,  %f,  %s,  %f,  %s,  %f" % (parc_number,refElev_feet,"not_used",vol3d_acft,"not_used",area2d_ac))
-            # The above line may be commented out if screen display is not needed.
-       
-            # Write the input and output values to the output file.
-
-            #RYAN COMMENT. Correct output (from top): parc_number, refElev_feet,  not_used,  Volume_acft,  not_used,  2D_Area_ac 
-            output.write("%i,  %f,  %s,  %f,  %s,  %f\r\n" % (parc_number,refElev_feet,"not_used", "not_used", vol3d_acft,area2d_ac))
-        
-            # Increment the refPlane elevation and loop and round to user-specified number of decimals
-            refElev_feet = round(refElev_feet + incElev_feet,numDecimals) # Round to avoid deviations due to floating point values.
-
-    except Exception, msg:
-        arcpy.AddMessage(str(msg))
-
-# Close files.
-inDEM_list.close()
-output.close()
-
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-stoptime = time.clock() 
-arcpy.AddMessage("%s %s" % ("DONE:  ", time.strftime("%I:%M:%S", time.localtime())))
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-arcpy.AddMessage("%s %s" % ("Output file location  =", outFile))
-arcpy.AddMessage("%s" % (""))  #space out screen messages
-arcpy.AddMessage("%s %.1f" % ("Elapsed time in minutes: ", ((stoptime-starttime)/60)))
+# Compute the StageLookup file(s) and write the run summaries (see stagelookup_run.create_stage_lookup).
+stagelookup_run.create_stage_lookup(inDEM_list_fullpath=os.path.join(inDEM_list_path,inDEM_list_name), inDEMpath=inDEMpath,
+                                    inDEMdatum=inDEMdatum, out_folder_path=out_folder_path,
+                                    startElev_feet=startElev_feet, endElev_feet=endElev_feet, incElev_feet=incElev_feet,
+                                    numDecimals=numDecimals, zFact=zFact, refPlane=refPlane, engine=engine, workers=workers,
+                                    resume=resume, tile_mb=tile_mb, inZonalDEM=inZonalDEM, inParcelRaster=inParcelRaster,
+                                    binary_store=binary_store, tolerance=tolerance, cache_folder=cache_folder, cache_mb=cache_mb,
+                                    outDatum2=outDatum2, datum_offset=datum_offset, compress=compress, starttime=starttime)
@@ -0,0 +1,176 @@
+######################################################################################################################################
+# $Id: arcpy_standin.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Local stand-in for the parts of arcpy used by the StageLookup modules, for benchmarks without ArcGIS.
+#
+#           stagelookup_benchmark.py installs this module as "arcpy" so that the stage-lookup generation can be run and
+#           timed on any machine with Python and NumPy.  It covers:
+#              Raster, Point, env, RasterToNumPyArray       rasters stored as NumPy .npy files (see save_raster), read
+#                                                           block by block through a memory map
+#              SurfaceVolume_3d, GetMessage, GetMessages    the same raster math as 3D Analyst Surface Volume, with the
+#                                                           result reported in a message of the same form
+#              AddMessage, AddWarning, AddError             counted, and printed only when verbose is set
+#              CheckOutExtension, GetParameterAsText, GetArgumentCount
+#
+#           A raster is a .npy file of the elevation array (row 0 at the top) with a .npy.json header holding the cell
+#           size, the lower left corner, the NoData value and the statistics (minimum and maximum).  Only the blocks
+#           asked for are read, so the peak memory of a tiled run reflects the tile size rather than the DEM size.
+#           SurfaceVolume_3d follows the rules of the NUMPY engine (stagelookup_engine.py): for BELOW, cells lower than
+#           the plane contribute their area and (plane - z) x area; for ABOVE, cells higher than the plane contribute
+#           their area and (z - plane) x area.  The 3D area is the cell area divided by the cosine of the cell slope.
+#
+######################################################################################################################################
+
+import math, json
+import numpy
+
+verbose  = False        # Print messages to the screen.
+messages = 0            # Number of AddMessage, AddWarning and AddError calls.
+_result  = []           # Messages of the last geoprocessing tool.
+
+
+class env(object):
+    overwriteOutput = False
+    workspace       = None
+
+
+class Point(object):
+    def __init__(self, X=None, Y=None):
+        self.X = X
+        self.Y = Y
+
+
+class Extent(object):
+    def __init__(self, XMin, YMin, XMax, YMax):
+        self.XMin, self.YMin, self.XMax, self.YMax = XMin, YMin, XMax, YMax
+
+
+def save_raster(path, z, cell_size, xmin=0.0, ymin=0.0, nodata=-9999.0, statistics=True):
+    """Write an elevation array (row 0 at the top, NoData cells set to nodata) as a stand-in raster.
+
+    The cells go to path (a .npy file) and the georeferencing, and the
+    statistics unless statistics is False, to path + ".json"."""
+    z = numpy.asarray(z)
+    numpy.save(path, z)
+    header = {"cell_size": float(cell_size), "xmin": float(xmin), "ymin": float(ymin), "nodata": float(nodata)}
+    valid = z[z != nodata]
+    if statistics and valid.size:
+        header["minimum"], header["maximum"] = float(valid.min()), float(valid.max())
+    f = open(path + ".json", "w")
+    json.dump(header, f, sort_keys=True)
+    f.close()
+
+
+class Raster(object):
+    """Raster written by save_raster.  Only the header is read; cells are read through a memory map when needed."""
+
+    def __init__(self, path):
+        f = open(path + ".json", "r")
+        header = json.load(f)
+        f.close()
+        self.catalogPath = path
+        self.meanCellWidth = self.meanCellHeight = header["cell_size"]
+        self.noDataValue = header["nodata"]
+        self.minimum = header.get("minimum")      # None without statistics, as in arcpy.
+        self.maximum = header.get("maximum")
+        self.height, self.width = self._cells().shape
+        xmin, ymin = header["xmin"], header["ymin"]
+        self.extent = Extent(xmin, ymin, xmin + self.width * self.meanCellWidth, ymin + self.height * self.meanCellHeight)
+
+    def _cells(self):
+        """Memory map of the cells.  Callers copy what they need and drop the map, so only the cells read are
+        held in memory."""
+        return numpy.load(self.catalogPath, mmap_mode="r")
+
+
+def _raster(in_raster):
+    if isinstance(in_raster, Raster):
+        return in_raster
+    return Raster(in_raster)
+
+
+def RasterToNumPyArray(in_raster, lower_left_corner=None, ncols=None, nrows=None, nodata_to_value=None):
+    """Block of a raster, row 0 at the top.  The block starts at the cell holding lower_left_corner."""
+    raster = _raster(in_raster)
+    z = raster._cells()
+    if lower_left_corner is not None:
+        col = int(math.floor((lower_left_corner.X - raster.extent.XMin) / raster.meanCellWidth))
+        bottom = int(math.floor((raster.extent.YMax - lower_left_corner.Y) / raster.meanCellHeight))
+        ncols = ncols or raster.width - col
+        nrows = nrows or bottom + 1
+        z = z[max(bottom - nrows + 1, 0):bottom + 1, col:col + ncols]
+    elif ncols or nrows:
+        z = z[raster.height - (nrows or raster.height):, :ncols or raster.width]
+    z = numpy.array(z)                            # Reads the block and releases the memory map.
+    if nodata_to_value is not None:
+        z[z == raster.noDataValue] = nodata_to_value
+    return z
+
+
+def SurfaceVolume_3d(in_surface, out_text_file="", reference_plane="ABOVE", base_z=0, z_factor=1, pyramid_level_resolution=0):
+    """2D area, 3D area and volume above or below a reference plane, reported like 3D Analyst Surface Volume."""
+    global _result
+    raster = _raster(in_surface)
+    z = numpy.array(raster._cells(), dtype=numpy.float64)
+    valid = z != raster.noDataValue
+    z = z * float(z_factor)
+    base_z = float(base_z)
+    cell_area = raster.meanCellWidth * raster.meanCellHeight
+
+    # Slope of every cell from central differences, for the 3D area.
+    gy, gx = numpy.gradient(numpy.where(valid, z, numpy.nan), raster.meanCellHeight, raster.meanCellWidth)
+    slope_factor = numpy.sqrt(1 + gx ** 2 + gy ** 2)
+    slope_factor[numpy.isnan(slope_factor)] = 1.0
+
+    if reference_plane.upper() == "BELOW":
+        cells = valid & (z < base_z)
+        depth = base_z - z[cells]
+    else:
+        cells = valid & (z > base_z)
+        depth = z[cells] - base_z
+    area2d = float(cells.sum() * cell_area)
+    area3d = float(slope_factor[cells].sum() * cell_area)
+    volume = float(depth.sum() * cell_area)          # Reported with repr(), so no digits are lost in the message.
+
+    _result = ["Executing: SurfaceVolume %s # %s %s %s %s" % (raster.catalogPath, reference_plane, base_z, z_factor,
+                                                              pyramid_level_resolution),
+               "Start Time: (stand-in)",
+               "Dataset=%s Plane_Height=%s Reference=%s Z_Factor=%s 2D Area= %r 3D Area= %r Volume= %r" % (
+                   raster.catalogPath, base_z, reference_plane.upper(), z_factor, area2d, area3d, volume),
+               "Succeeded (stand-in)"]
+    if out_text_file:
+        f = open(out_text_file, "a")
+        f.write("%s\n" % _result[2])
+        f.close()
+
+
+def GetMessage(index):
+    return _result[index]
+
+
+def GetMessages(severity=0):
+    return "\n".join(_result)
+
+
+def AddMessage(message):
+    global messages
+    messages += 1
+    if verbose:
+        print(message)
+
+
+AddWarning = AddMessage
+AddError   = AddMessage
+
+
+def CheckOutExtension(extension_code):
+    return "CheckedOut"
+
+
+def GetParameterAsText(index):
+    return ""
+
+
+def GetArgumentCount():
+    return 0
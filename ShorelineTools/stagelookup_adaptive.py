@@ -0,0 +1,199 @@
+######################################################################################################################################
+# $Id: stagelookup_adaptive.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  ADAPTIVE engine: adaptive stage sampling, with an error bound, for the SurfaceVolume_3d backend.
+#
+#           Sampling every stage increment with an expensive arcpy.SurfaceVolume_3d call wastes most calls, because
+#           much of the stage range is trivial:
+#              - planes on the dry side of the DEM (below the lowest cell for BELOW, above the highest for ABOVE)
+#                have zero area and volume;
+#              - planes on the wet side (above the highest cell for BELOW, below the lowest for ABOVE) have the full
+#                parcel area and a volume that changes linearly with stage.
+#           The ADAPTIVE engine first reads the minimum and maximum elevation of the parcel DEM (from its statistics, or
+#           from a tiled read of a DEM without statistics), fills the dry side with zeros and the wet side analytically
+#           from a single anchor call, and checks both fills with one call at the dry stage next to the DEM and one at
+#           the wet stage farthest from the anchor.  Out-of-date or approximate statistics fail the check; the
+#           elevation range is then read from the DEM tile by tile and the fills are redone.  It then samples the stages
+#           in between on a coarse grid and bisects every interval until interpolation between its ends is known to be
+#           within the user tolerance (acres for area, acre-feet for volume).  The 2D area changes monotonically with
+#           stage, so between two samples it lies between their areas: linear interpolation of the area is off by at most
+#           the difference of the two areas, and the volume, the integral of the area over stage, by at most that
+#           difference times the stage interval.  Intervals whose bounds are within the tolerance are filled on the final
+#           uniform stage grid, area linearly and volume by integrating the interpolated area; the others are bisected.
+#
+#           The bound holds for every stage written, not only at the sampled ones.  A tolerance smaller than the area
+#           of a few DEM cells leaves little to interpolate on rough terrain.
+#
+######################################################################################################################################
+
+import numpy
+import arcpy
+import stagelookup_engine
+
+DEFAULT_TOLERANCE    = 0.001     # Acres and acre-feet.
+DEFAULT_INITIAL_STEP = 16        # Stage increments between the samples of the initial grid.
+ELEVATION_MARGIN     = 1e-4      # Meters; keeps the analytic regions clear of the DEM statistics rounding.
+
+
+class SamplingStats(object):
+    """Backend calls made and stages written by the ADAPTIVE engine in this process."""
+
+    def __init__(self):
+        self.calls  = 0
+        self.stages = 0
+
+    def add(self, calls, stages):
+        self.calls  += calls
+        self.stages += stages
+
+    def take(self):
+        """Return (calls, stages) and reset, so worker processes can hand them to the parent."""
+        counts = (self.calls, self.stages)
+        self.calls, self.stages = 0, 0
+        return counts
+
+STATS = SamplingStats()
+
+
+def elevation_range(inDEM, tile_mb=stagelookup_engine.DEFAULT_TILE_MB, statistics=True):
+    """Lowest and highest cell value of the DEM, or None when it has NoData cells only.
+
+    Raster.minimum and Raster.maximum are None for a raster without
+    statistics; the values are then read from the DEM tile by tile, as they
+    are when statistics is False."""
+    raster = arcpy.Raster(inDEM)
+    if statistics and raster.minimum is not None and raster.maximum is not None:
+        return raster.minimum, raster.maximum
+    zlo, zhi = None, None
+    for z in stagelookup_engine.dem_tiles(raster, tile_mb):
+        z = z[~numpy.isnan(z)]
+        if z.size:
+            zlo = z.min() if zlo is None else min(zlo, z.min())
+            zhi = z.max() if zhi is None else max(zhi, z.max())
+    if zlo is None:
+        return None
+    return float(zlo), float(zhi)
+
+
+def adaptive_volume_table(inDEM, stages_feet, refPlane, zFact, tolerance=DEFAULT_TOLERANCE,
+                          initial_step=DEFAULT_INITIAL_STEP, evaluate=None, tile_mb=stagelookup_engine.DEFAULT_TILE_MB):
+    """Compute (vol3d_acft, area2d_ac) for every stage from adaptively chosen SurfaceVolume_3d calls.
+
+    evaluate(refElev_feet) -> (vol3d_acft, area2d_ac) replaces the backend call.
+    tile_mb is the memory budget of one DEM tile when the elevation range is
+    read from the DEM."""
+    if evaluate is None:
+        evaluate = lambda refElev_feet: stagelookup_engine.surface_volume(inDEM, refElev_feet, refPlane, zFact)
+    tolerance = float(tolerance or DEFAULT_TOLERANCE)
+    below = refPlane.upper() == "BELOW"
+
+    n = len(stages_feet)
+    planes = numpy.asarray(stages_feet, dtype=numpy.float64) / stagelookup_engine.FEET_PER_METER
+    vol3d_acft = numpy.zeros(n)
+    area2d_ac  = numpy.zeros(n)
+    if n == 0:
+        return vol3d_acft, area2d_ac
+
+    known = {}
+    calls = [0]
+
+    def sample(i):
+        if i not in known:
+            known[i] = evaluate(stages_feet[i])
+            calls[0] += 1
+        return known[i]
+
+    # Dry side: zero area and volume, no backend call.  Wet side: linear in stage from one anchor call.
+    #    Volume changes by area x depth, converted from square meters x meters to acre-feet.
+    to_acft = stagelookup_engine.SQ_METERS_PER_ACRE / stagelookup_engine.CU_METERS_PER_ACRE_FOOT
+    for statistics in [True, False]:
+        # Lowest and highest surface elevation (meters, after zFact).
+        zrange = elevation_range(inDEM, tile_mb, statistics)
+        if zrange is None:
+            STATS.add(calls[0], n)
+            return vol3d_acft, area2d_ac               # NoData only: zero area and volume at every stage.
+        zlo, zhi = sorted([zrange[0] * float(zFact), zrange[1] * float(zFact)])
+        lo = int(numpy.searchsorted(planes, zlo - ELEVATION_MARGIN, side="left"))   # First plane that can cut the DEM.
+        hi = int(numpy.searchsorted(planes, zhi + ELEVATION_MARGIN, side="right"))  # First plane clear above the DEM.
+
+        if below:
+            dry, wet, anchor = range(0, lo), range(hi + 1, n), hi
+        else:
+            dry, wet, anchor = range(hi, n), range(0, lo - 1), lo - 1
+        fill = {}
+        for i in dry:
+            fill[i] = (0.0, 0.0)
+        if 0 <= anchor < n:
+            vol_a, area_a = sample(anchor)
+            for i in wet:
+                depth = planes[i] - planes[anchor] if below else planes[anchor] - planes[i]
+                fill[i] = (vol_a + area_a * depth * to_acft, area_a)
+
+        # Area and volume are monotonic in stage, so the fills are furthest off at the dry stage next to the DEM
+        #    and at the wet stage farthest from the anchor.  One call at each checks the DEM statistics.
+        checks = []
+        if dry:
+            checks.append(dry[-1] if below else dry[0])
+        if wet:
+            checks.append(wet[-1] if below else wet[0])
+        if not statistics or all([abs(sample(i)[0] - fill[i][0]) <= tolerance and
+                                  abs(sample(i)[1] - fill[i][1]) <= tolerance for i in checks]):
+            break
+        arcpy.AddWarning("%s %s" % ("Adaptive sampling: the statistics do not match the cells, reading the elevation range of",
+                                    inDEM))
+    for i in fill:
+        if i not in known:
+            known[i] = fill[i]
+
+    # Stages that cut the DEM, with one known stage on each side where there is one.
+    first = max(min(lo, hi) - 1, 0)
+    last  = min(max(lo, hi), n - 1)
+    grid = sorted(set(range(first, last + 1, max(int(initial_step), 1)) + [first, last]))
+    for i in grid:
+        sample(i)
+
+    # Area changes monotonically with stage, so between two samples it stays between their areas: linear
+    #    interpolation is off by at most |area_j - area_i| acres, and the volume, the integral of the area, by at
+    #    most |area_j - area_i| x (stage_j - stage_i) acre-feet.  An interval is filled only once both bounds are
+    #    within the tolerance; otherwise it is bisected.
+    stack = [(grid[k], grid[k + 1]) for k in range(len(grid) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i <= 1:
+            continue
+        vol_i, area_i = sample(i)
+        vol_j, area_j = sample(j)
+        area_error = abs(area_j - area_i)
+        if area_error > tolerance or area_error * abs(stages_feet[j] - stages_feet[i]) > tolerance:
+            m = (i + j) // 2
+            sample(m)
+            stack.append((i, m))
+            stack.append((m, j))
+            continue
+
+        # Area linear between the samples, volume integrated from it (trapezoid).
+        h = planes[j] - planes[i]
+        for k in range(i + 1, j):
+            if k not in known:
+                d = planes[k] - planes[i]
+                vol_k = vol_i + (area_i * d + (area_j - area_i) * d * d / (2 * h)) * to_acft * (1 if below else -1)
+                known[k] = (max(vol_k, 0.0), area_i + d / h * (area_j - area_i))
+
+    for i in range(n):
+        vol3d_acft[i], area2d_ac[i] = known[i]
+
+    STATS.add(calls[0], n)
+    arcpy.AddMessage("%s %i %s %i %s %i %s" % ("Adaptive sampling:", calls[0], "SurfaceVolume_3d calls for", n,
+                                              "stages (", n - calls[0], "calls saved)"))
+    return vol3d_acft, area2d_ac
+
+
+def report_summary():
+    """Write the backend calls made and saved by the ADAPTIVE engine to the screen."""
+    calls, stages = STATS.calls, STATS.stages
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    arcpy.AddMessage("%s" % ("ADAPTIVE SAMPLING SUMMARY:"))
+    arcpy.AddMessage("%s %i" % ("   Stages written                     =", stages))
+    arcpy.AddMessage("%s %i" % ("   SurfaceVolume_3d calls made        =", calls))
+    arcpy.AddMessage("%s %i" % ("   SurfaceVolume_3d calls saved       =", stages - calls))
@@ -0,0 +1,208 @@
+######################################################################################################################################
+# $Id: stagelookup_benchmark.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Reproducible benchmark of the StageLookup generation with synthetic DEMs and the local arcpy stand-in.
+#
+#           The run times in the header of Create_Stagelookup_Data_Table_v2.py (1-m and 5-m DEMs x 0.10 and 0.01 ft
+#           increments, 34 parcels, ArcMap 10.0) cannot be reproduced without ArcGIS.  This benchmark runs the same
+#           matrix on any machine with Python and NumPy:
+#              - synthetic parcel DEMs are generated at each resolution from the same terrain function and random seed,
+#                so every resolution represents the same valley and every run the same DEMs;
+#              - arcpy_standin.py is installed as arcpy, so the stage-lookup modules run unchanged, SurfaceVolume_3d
+#                included;
+#              - every (resolution, increment, engine) cell runs stagelookup_run.run_stage_lookup in its own process.
+#
+#           Reported for every cell: total time, mean and slowest per-iteration latency (parcel time / stages),
+#           throughput in stage evaluations per second, peak memory of the largest process (resident set size; Unix
+#           only) and the md5 checksum of the StageLookup file, which must not change between versions of one engine.
+#           The NUMPY and SURFACEVOLUME engines sum the cells in a different order, so their values can differ in the
+#           last digit written and their checksums are not compared.
+#
+#           Usage (stand-alone Python, not ArcGIS):
+#              python stagelookup_benchmark.py [--resolutions 1,5] [--increments 0.10,0.01] [--engines NUMPY]
+#                                              [--parcels 34] [--size 400] [--workers 1] [--tile_mb 256]
+#                                              [--folder DIR] [--csv FILE]
+#
+######################################################################################################################################
+
+import sys, os, time, json, hashlib, tempfile, subprocess, argparse
+import numpy
+
+import arcpy_standin
+sys.modules["arcpy"] = arcpy_standin          # Before any stage-lookup module imports arcpy.
+
+import stagelookup_engine, stagelookup_run
+
+ZMIN_METERS = 1260.5                            # Synthetic valley floor, just above the 4135.30 ft start of the header runs.
+ZMAX_METERS = 1273.0                            # Synthetic parcel rims, just above the 4176.30 ft end of the header runs.
+COLUMNS = ["resolution_m", "increment_ft", "engine", "parcels", "stages", "iterations", "total_s", "latency_ms",
+           "max_latency_ms", "evaluations_per_s", "peak_mb", "md5"]
+
+
+def terrain(x, y, seed):
+    """Elevation (meters) of a synthetic parcel at ground coordinates x, y (meters from the parcel center).
+
+    A bowl with a tilted floor, a meandering channel and low hummocks; the
+    same function at every resolution, so only the sampling changes."""
+    rng = numpy.random.RandomState(seed)
+    r = numpy.sqrt(x ** 2 + y ** 2) / max(numpy.abs(x).max(), numpy.abs(y).max(), 1.0)
+    tilt = (x / (numpy.abs(x).max() + 1.0) + 1) / 2
+    z = ZMIN_METERS + (ZMAX_METERS - ZMIN_METERS) * (0.15 * tilt + 0.85 * numpy.minimum(r, 1.0) ** 1.6)
+    for k in range(4):
+        wave = 2 * numpy.pi / rng.uniform(40.0, 160.0)
+        z += rng.uniform(0.05, 0.25) * numpy.sin(wave * x + rng.uniform(0, 6.3)) * numpy.cos(wave * y + rng.uniform(0, 6.3))
+    channel = numpy.abs(y - 0.2 * numpy.abs(y).max() * numpy.sin(x / rng.uniform(30.0, 90.0)))
+    z -= 1.0 * numpy.exp(-(channel / 10.0) ** 2)
+    return z
+
+
+def make_dem(path, size_m, cell_m, seed):
+    """Write a synthetic parcel DEM of size_m x size_m meters with cell_m cells; NoData outside the parcel outline."""
+    n = max(int(round(size_m / cell_m)), 2)
+    coords = (numpy.arange(n) + 0.5) * cell_m - size_m / 2.0
+    x, y = numpy.meshgrid(coords, -coords)
+    z = terrain(x, y, seed)
+
+    # Irregular parcel outline: an ellipse with a wavy edge.
+    rng = numpy.random.RandomState(seed + 1000)
+    angle = numpy.arctan2(y, x)
+    edge = 0.5 * size_m * (0.85 + 0.1 * numpy.sin(3 * angle + rng.uniform(0, 6.3)))
+    z[numpy.sqrt((x / rng.uniform(0.8, 1.0)) ** 2 + y ** 2) > edge] = -9999.0
+    arcpy_standin.save_raster(path, z.astype(numpy.float32), cell_m)
+
+
+def make_parcels(folder, parcels, size_m, cell_m):
+    """Generate the DEMs and the input list of DEMs of one resolution (reused when they already exist)."""
+    dem_folder = os.path.join(folder, "dem_%gm_%gm" % (cell_m, size_m))
+    if not os.path.exists(dem_folder):
+        os.makedirs(dem_folder)
+    list_file = os.path.join(dem_folder, "dem_list_%i.csv" % parcels)
+    f = open(list_file, "w")
+    for parc_number in range(1, parcels + 1):
+        name = "parcel_%03i.npy" % parc_number
+        if not os.path.exists(os.path.join(dem_folder, name)):
+            make_dem(os.path.join(dem_folder, name), size_m, cell_m, parc_number)
+        f.write("%i,%s\n" % (parc_number, name))
+    f.close()
+    return list_file, dem_folder
+
+
+class _TimedOutput(object):
+    """Output file that records when each parcel is finished, for the per-parcel latency."""
+
+    def __init__(self, f):
+        self.f = f
+        self.times = [time.time()]
+
+    def write(self, block):
+        self.f.write(block)
+        self.times.append(time.time())
+
+
+def peak_memory_mb():
+    """Peak resident set size, in megabytes, of this process or its largest worker; None where it is not available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == "darwin":
+        return peak / 1048576.0                     # Bytes on Mac OS.
+    return peak / 1024.0                            # Kilobytes on Linux.
+
+
+def run_cell(folder, cell_m, incElev_feet, engine, parcels, size_m, startElev_feet, endElev_feet, workers, tile_mb=None):
+    """Run one cell of the matrix in this process and return its results."""
+    list_file, dem_folder = make_parcels(folder, parcels, size_m, cell_m)
+    stages_feet = stagelookup_engine.stage_list(startElev_feet, endElev_feet, incElev_feet, 2)
+    parcel_list = stagelookup_run.read_dem_list(list_file, dem_folder)
+
+    outFile = os.path.join(folder, "StageLookup_%gm_%gft_%s.txt" % (cell_m, incElev_feet, engine))
+    f = open(outFile, "w")
+    f.write(stagelookup_engine.header_line(list_file))
+    output = _TimedOutput(f)
+    start = time.time()
+    stagelookup_run.run_stage_lookup(parcel_list, output, stages_feet, "BELOW", 1.0, engine, workers, folder, tile_mb=tile_mb)
+    total = time.time() - start
+    f.close()
+
+    f = open(outFile, "rb")
+    md5 = hashlib.md5(f.read()).hexdigest()
+    f.close()
+    os.remove(outFile)
+
+    parcel_times = numpy.diff(output.times)
+    iterations = len(stages_feet) * len(parcel_list)
+    return {"resolution_m": cell_m, "increment_ft": incElev_feet, "engine": engine, "parcels": len(parcel_list),
+            "stages": len(stages_feet), "iterations": iterations, "total_s": total,
+            "latency_ms": 1000.0 * total / iterations,
+            "max_latency_ms": 1000.0 * parcel_times.max() / len(stages_feet) if len(parcel_times) else 0.0,
+            "evaluations_per_s": iterations / total if total > 0 else 0.0,
+            "peak_mb": peak_memory_mb(), "md5": md5}
+
+
+def format_result(result):
+    peak = result["peak_mb"]
+    return "%6g m  %5.2f ft  %-13s %4i  %6i  %9i  %9.2f  %9.4f  %9.4f  %12.0f  %8s  %s" % (
+        result["resolution_m"], result["increment_ft"], result["engine"], result["parcels"], result["stages"],
+        result["iterations"], result["total_s"], result["latency_ms"], result["max_latency_ms"],
+        result["evaluations_per_s"], "n/a" if peak is None else "%.1f" % peak, result["md5"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the StageLookup generation with synthetic DEMs.")
+    parser.add_argument("--resolutions", default="1,5", help="DEM cell sizes, in meters (default 1,5)")
+    parser.add_argument("--increments", default="0.10,0.01", help="Stage increments, in feet (default 0.10,0.01)")
+    parser.add_argument("--engines", default="NUMPY", help="Stage-volume engines (default NUMPY); " + ", ".join(stagelookup_engine.ENGINES))
+    parser.add_argument("--parcels", type=int, default=34, help="Number of parcels (default 34)")
+    parser.add_argument("--size", type=float, default=400.0, help="Parcel width and height, in meters (default 400)")
+    parser.add_argument("--start", type=float, default=4135.30, help="Starting elevation, in feet (default 4135.30)")
+    parser.add_argument("--end", type=float, default=4176.30, help="Ending elevation, in feet (default 4176.30)")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel worker processes (default 1)")
+    parser.add_argument("--tile_mb", type=float, default=None,
+                        help="Memory budget of one DEM tile, in megabytes (default %i)" % stagelookup_engine.DEFAULT_TILE_MB)
+    parser.add_argument("--folder", default=None, help="Folder for the synthetic DEMs (default: a new temporary folder)")
+    parser.add_argument("--csv", default=None, help="Also write the results to this CSV file")
+    parser.add_argument("--cell", default=None, help=argparse.SUPPRESS)      # Internal: run one cell and print its results.
+    args = parser.parse_args(argv)
+
+    if args.cell is not None:
+        cell = json.loads(args.cell)
+        print(json.dumps(run_cell(**cell)))
+        return
+
+    folder = args.folder or tempfile.mkdtemp(prefix="StageLookupBenchmark_")
+    print("Synthetic DEMs in %s" % folder)
+    print("%8s  %8s  %-13s %4s  %6s  %9s  %9s  %9s  %9s  %12s  %8s  %s" % ("res", "inc", "engine", "parc", "stages",
+          "iter", "total_s", "lat_ms", "max_ms", "eval/s", "peak_MB", "md5"))
+
+    results = []
+    for cell_m in [float(x) for x in args.resolutions.split(",")]:
+        for incElev_feet in [float(x) for x in args.increments.split(",")]:
+            for engine in [x.strip().upper() for x in args.engines.split(",")]:
+                cell = {"folder": folder, "cell_m": cell_m, "incElev_feet": incElev_feet, "engine": engine,
+                        "parcels": args.parcels, "size_m": args.size, "startElev_feet": args.start,
+                        "endElev_feet": args.end, "workers": args.workers, "tile_mb": args.tile_mb}
+                # Each cell runs in a new process, so its peak memory is its own.
+                child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--cell", json.dumps(cell)],
+                                         stdout=subprocess.PIPE)
+                out = child.communicate()[0]
+                if child.returncode != 0:
+                    raise RuntimeError("Benchmark cell %s failed" % json.dumps(cell))
+                result = json.loads(out.decode("ascii").strip().splitlines()[-1])
+                print(format_result(result))
+                sys.stdout.flush()
+                results.append(result)
+
+    if args.csv:
+        f = open(args.csv, "w")
+        f.write(",".join(COLUMNS) + "\n")
+        for result in results:
+            f.write(",".join([str(result[column]) for column in COLUMNS]) + "\n")
+        f.close()
+    return results
+
+
+if __name__ == "__main__":
+    main()
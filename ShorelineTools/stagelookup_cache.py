@@ -0,0 +1,180 @@
+######################################################################################################################################
+# $Id: stagelookup_cache.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Content-addressed on-disk cache of per-parcel stage-volume results, for incremental re-runs.
+#
+#           Re-running the tool after one parcel DEM was re-surveyed, or after widening startElev_feet/endElev_feet,
+#           used to repeat the whole multi-hour run.  With a cache folder, every parcel's (stage, volume, area) values
+#           are kept in one file per cache key:
+#              key   md5 of the DEM content (cell values, size, cell size and extent), zFact, refPlane, the unit
+#                    conversions of stagelookup_engine and the method (the engine, and for ADAPTIVE its tolerance)
+#              file  <key>.npz holding the stages (micro-feet, int64), Volume_acft and 2D_Area_ac of every stage computed
+#
+#           A run looks up each parcel, computes only the stages not yet cached (none for an unchanged parcel, all for
+#           a changed DEM), adds them to the entry and assembles the StageLookup records from the cache.  Every engine
+#           has its own entries: NUMPY and SURFACEVOLUME agree only to rounding in the last digit written, and the
+#           output must not depend on which engine filled the cache.  The DEM is read once per run to hash it.
+#
+#           Least recently used entries are evicted at the end of a run until the cache fits in cache_mb megabytes.
+#           Parcel hits, partial hits and misses, and stages reused and computed, are reported at the end of the run.
+#
+######################################################################################################################################
+
+import os, glob, hashlib
+import numpy
+import arcpy
+import stagelookup_engine, stagelookup_metrics
+
+DEFAULT_CACHE_MB = 1024     # Size limit, in megabytes, of the cache folder.
+MICRO = 1000000             # Stages are matched as integer micro-feet to avoid floating point comparisons.
+
+
+def dem_digest(inDEM, tile_mb=stagelookup_engine.DEFAULT_TILE_MB):
+    """md5 of the cell values and geometry of a DEM, read tile by tile."""
+    raster = arcpy.Raster(inDEM)
+    md5 = hashlib.md5()
+    md5.update(repr((raster.height, raster.width, raster.meanCellWidth, raster.meanCellHeight,
+                     raster.extent.XMin, raster.extent.YMax)))
+    for z in stagelookup_engine.dem_tiles(raster, tile_mb):
+        md5.update(numpy.ascontiguousarray(z).tostring())
+    return md5.hexdigest()
+
+
+def cache_method(engine, tolerance=None):
+    """Part of the cache key that tells the results of the engines apart.
+
+    The engines round differently in the last digit, so each has its own
+    entries; ADAPTIVE entries are also kept per tolerance."""
+    engine = (engine or "NUMPY").upper()
+    if engine == "ADAPTIVE":
+        return "ADAPTIVE %r" % float(tolerance or 0)
+    return engine
+
+
+class ResultCache(object):
+    """Per-parcel stage-volume results kept in a folder, keyed by DEM content and run parameters."""
+
+    def __init__(self, folder, max_mb=DEFAULT_CACHE_MB):
+        self.folder = folder
+        self.max_mb = float(max_mb or DEFAULT_CACHE_MB)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.counts  = [0, 0, 0, 0, 0]     # Parcel hits, partial hits, misses; stages reused, stages computed.
+        self.evicted = 0
+
+    def key(self, inDEM, refPlane, zFact, method, tile_mb=None):
+        digest = dem_digest(inDEM, tile_mb or stagelookup_engine.DEFAULT_TILE_MB)
+        return hashlib.md5(repr((digest, float(zFact), refPlane.upper(), stagelookup_engine.FEET_PER_METER,
+                                 stagelookup_engine.SQ_METERS_PER_ACRE, stagelookup_engine.CU_METERS_PER_ACRE_FOOT,
+                                 method))).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + ".npz")
+
+    def _load(self, key):
+        """(micro_feet, vol3d_acft, area2d_ac) of a cache entry; empty arrays if there is none."""
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except IOError:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0), numpy.zeros(0)
+        try:
+            entry = numpy.load(f)
+            result = entry["micro_feet"], entry["vol3d_acft"], entry["area2d_ac"]
+        finally:
+            f.close()
+        os.utime(path, None)                                  # Mark as recently used for eviction.
+        return result
+
+    def _save(self, key, micro_feet, vol3d_acft, area2d_ac):
+        """Write a cache entry through a temporary file, so a crash never leaves a partial entry."""
+        path = self._path(key)
+        tmp = "%s.%i.tmp" % (path, os.getpid())
+        f = open(tmp, "wb")
+        numpy.savez(f, micro_feet=micro_feet, vol3d_acft=vol3d_acft, area2d_ac=area2d_ac)
+        f.close()
+        if os.path.exists(path):
+            os.remove(path)                                   # os.rename does not replace files on Windows.
+        os.rename(tmp, path)
+
+    def volume_table(self, inDEM, stages_feet, refPlane, zFact, engine="NUMPY", tile_mb=None, tolerance=None):
+        """stagelookup_engine.volume_table, computing only the stages not already in the cache."""
+        key = self.key(inDEM, refPlane, zFact, cache_method(engine, tolerance), tile_mb)
+        cached_micro, cached_vol, cached_area = self._load(key)
+
+        micro = numpy.round(numpy.asarray(stages_feet, dtype=numpy.float64) * MICRO).astype(numpy.int64)
+        missing = ~numpy.in1d(micro, cached_micro)
+        nmissing = int(missing.sum())
+        if nmissing:
+            vol3d_acft, area2d_ac = stagelookup_engine.volume_table(inDEM, [s for s, m in zip(stages_feet, missing) if m],
+                                                                    refPlane, zFact, engine, tile_mb, tolerance)
+            cached_micro = numpy.concatenate([cached_micro, micro[missing]])
+            cached_vol   = numpy.concatenate([cached_vol, vol3d_acft])
+            cached_area  = numpy.concatenate([cached_area, area2d_ac])
+            order = numpy.argsort(cached_micro, kind="mergesort")
+            cached_micro, cached_vol, cached_area = cached_micro[order], cached_vol[order], cached_area[order]
+            self._save(key, cached_micro, cached_vol, cached_area)
+
+        if nmissing == 0:
+            self.counts[0] += 1
+        elif nmissing < len(micro):
+            self.counts[1] += 1
+        else:
+            self.counts[2] += 1
+        self.counts[3] += len(micro) - nmissing
+        self.counts[4] += nmissing
+        stagelookup_metrics.TIMER.add(reused=len(micro) - nmissing)    # Not stage evaluations of this run.
+
+        i = numpy.searchsorted(cached_micro, micro)
+        return cached_vol[i], cached_area[i]
+
+    def take(self):
+        """Return the counts and reset them, so worker processes can hand them to the parent."""
+        counts = tuple(self.counts)
+        self.counts = [0, 0, 0, 0, 0]
+        return counts
+
+    def add(self, counts):
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+
+    def entries(self):
+        """(path, size in bytes, last use) of every cache entry."""
+        result = []
+        for path in glob.glob(os.path.join(self.folder, "*.npz")):
+            try:
+                result.append((path, os.path.getsize(path), os.path.getmtime(path)))
+            except OSError:
+                pass                                          # Removed by another run.
+        return result
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_mb megabytes."""
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        size = sum([entry[1] for entry in entries])
+        limit = self.max_mb * 1024 * 1024
+        for path, nbytes, used in entries:
+            if size <= limit:
+                break
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except OSError:
+                pass
+            size -= nbytes
+        return self.evicted
+
+    def report_summary(self):
+        """Write the cache statistics of this run to the screen."""
+        hits, partial, misses, reused, computed = self.counts
+        entries = self.entries()
+        arcpy.AddMessage("%s" % (""))  #space out screen messages
+        arcpy.AddMessage("%s %s" % ("RESULT CACHE SUMMARY:", self.folder))
+        arcpy.AddMessage("%s %i" % ("   Parcels found in cache (hits)      =", hits))
+        arcpy.AddMessage("%s %i" % ("   Parcels partly in cache            =", partial))
+        arcpy.AddMessage("%s %i" % ("   Parcels not in cache (misses)      =", misses))
+        arcpy.AddMessage("%s %i" % ("   Stages reused from cache           =", reused))
+        arcpy.AddMessage("%s %i" % ("   Stages computed                    =", computed))
+        arcpy.AddMessage("%s %i" % ("   Entries evicted                    =", self.evicted))
+        arcpy.AddMessage("%s %i %s %.1f %s" % ("   Cache size                         =", len(entries), "entries,",
+                                              sum([entry[1] for entry in entries]) / 1048576.0, "MB"))
@@ -0,0 +1,89 @@
+######################################################################################################################################
+# $Id: stagelookup_datum.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  StageLookup tables for a second vertical datum from the same pass over the DEMs.
+#
+#           The data tables are needed for each vertical datum used by the Shoreline Management Tool (StageLookupNAVD88.txt
+#           and StageLookupNGVD29.txt).  Instead of a second set of DEMs and a second run, the user gives the name of the
+#           second datum and the datum offset, in feet, such that
+#              elevation in the second datum = elevation in the DEM datum + datum_offset
+#           either as one constant or, for offsets that vary across the valley, as a file of "parc_number,offset_feet"
+#           records (one per parcel, in the format of the input list of DEMs).
+#
+#           The stage grid of the second datum is the grid of the DEM datum shifted by the offset and rounded to
+#           numDecimals, so both files cover the same water surfaces.  Each of its stages is the reference plane
+#           (stage - offset) in the DEM datum; the planes of both datums are computed together, in one read and one
+#           sweep of each DEM, and the shifted records are taken from that result.  When the offset is a multiple of the
+#           stage increment the planes of both datums are the same and nothing extra is computed; otherwise the planes
+#           of the second datum fall between those of the first and are added to the same sweep (for the SURFACEVOLUME
+#           and ADAPTIVE engines they are extra SurfaceVolume_3d calls).
+#
+######################################################################################################################################
+
+import numpy
+
+MICRO = 1000000             # Planes are matched as integer micro-feet to avoid floating point comparisons.
+
+
+def read_offsets(datum_offset):
+    """Datum offset in feet: a constant, or {parc_numSTR: offset} read from a "parc_number,offset_feet" file."""
+    if datum_offset is None or str(datum_offset).strip() == "":
+        raise ValueError("A second output datum needs datum_offset: the offset in ft, or a file of parc_number,offset_feet")
+    try:
+        return float(datum_offset)
+    except ValueError:
+        pass
+
+    offsets = {}
+    offset_list = open(datum_offset, "r")
+    for aLine in offset_list:
+        if len(aLine.strip()) < 1:
+            break
+        parc_numSTR, offsetSTR = aLine.split(",")
+        offsets[parc_numSTR.strip()] = float(offsetSTR)
+    offset_list.close()
+    return offsets
+
+
+class DatumGrids(object):
+    """Stage grids of the output datums of a run; the first is the DEM datum itself (offset 0)."""
+
+    def __init__(self, offsets, numDecimals):
+        """offsets: one entry per output datum, each a constant or {parc_numSTR: offset}."""
+        self.offsets     = list(offsets)
+        self.numDecimals = numDecimals
+        self.constant    = not [offset for offset in self.offsets if isinstance(offset, dict)]
+
+    def parcel_offsets(self, parc_numSTR):
+        """Offset of every output datum for one parcel."""
+        result = []
+        for offset in self.offsets:
+            if isinstance(offset, dict):
+                if parc_numSTR not in offset:
+                    raise KeyError("No datum offset for parcel %s" % parc_numSTR)
+                offset = offset[parc_numSTR]
+            result.append(float(offset))
+        return result
+
+    def grids(self, stages_feet, parc_numSTR=None):
+        """Planes to compute and the records of every datum.
+
+        Returns (planes_feet, [(stages_feet, index)]) where planes_feet are the
+        reference planes (DEM datum) of all datums together, sorted, and index
+        selects the values of each datum's stages from the result for planes_feet."""
+        if parc_numSTR is None and not self.constant:
+            raise ValueError("Per-parcel datum offsets need a parcel number")
+        datums = []
+        for offset in self.parcel_offsets(parc_numSTR):
+            labels = [round(refElev_feet + offset, self.numDecimals) for refElev_feet in stages_feet]
+            planes = numpy.round((numpy.array(labels, dtype=numpy.float64) - offset) * MICRO).astype(numpy.int64)
+            datums.append((labels, planes))
+
+        union = numpy.unique(numpy.concatenate([planes for labels, planes in datums]))
+        return (union / float(MICRO)).tolist(), [(labels, numpy.searchsorted(union, planes)) for labels, planes in datums]
+
+    def tables(self, parc_number, grids, vol3d_acft, area2d_ac):
+        """(parc_number, stages_feet, vol3d_acft, area2d_ac) of one parcel for every datum, from the values computed
+        for the planes."""
+        return [(parc_number, labels, vol3d_acft[index], area2d_ac[index]) for labels, index in grids]
@@ -0,0 +1,261 @@
+######################################################################################################################################
+# $Id: stagelookup_engine.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Stage-volume engines used to build the StageLookup data tables of the Shoreline Management Tool.
+#
+#           Three engines are provided:
+#              NUMPY          Reads each parcel DEM once, bins the cell elevations against the full list of reference
+#                             plane elevations and computes the 2D area and volume for every stage in one vectorized
+#                             sweep of a cumulative histogram.  Cost per parcel is O(cells + stages).
+#              SURFACEVOLUME  The original method: one call to arcpy.SurfaceVolume_3d per stage increment, parsing the
+#                             2D area and volume out of the tool message.  Cost per parcel is O(cells x stages).
+#              ADAPTIVE       SurfaceVolume_3d at adaptively chosen stages only, within a user tolerance; the other
+#                             stages are filled analytically or by interpolation (see stagelookup_adaptive.py).
+#
+#           The NUMPY engine reproduces the raster semantics of SurfaceVolume_3d:
+#              BELOW  cells whose elevation (times zFact) is less than the reference plane contribute their cell area
+#                     to the 2D area and (plane - z) x cell area to the volume.
+#              ABOVE  cells whose elevation (times zFact) is greater than the reference plane contribute their cell area
+#                     to the 2D area and (z - plane) x cell area to the volume.
+#              NoData cells never contribute.
+#
+#           The NUMPY engine reads the DEM in tiles (strips of rows, or blocks of columns for very wide rasters) sized to
+#           a memory budget (tile_mb) and adds each tile to the histogram, so peak memory is bounded by the budget and the
+#           number of stages and not by the size of the DEM.  1-m DEMs larger than the available RAM can be processed.
+#
+#           Assumption 1 of Create_Stagelookup_Data_Table_v2.py still applies: DEM elevation and ground units are meters.
+#
+######################################################################################################################################
+
+import time
+import numpy
+import stagelookup_metrics
+
+# Unit conversions used by the original script (keep these exact so both engines write identical tables).
+FEET_PER_METER          = 3.280833    # Reference plane elevation: refElev_meters = refElev_feet/3.280833
+SQ_METERS_PER_ACRE      = 4046.873    # 2D area: area2d_ac = area2d_m2 / 4046.873
+CU_METERS_PER_ACRE_FOOT = 1233.489    # Volume:  vol3d_acft = vol3d_m3 / 1233.489
+
+ENGINES    = ["NUMPY", "SURFACEVOLUME", "ADAPTIVE"]
+REF_PLANES = ["ABOVE", "BELOW"]
+
+DEFAULT_TILE_MB = 256   # Memory budget, in megabytes, for one DEM tile.
+BYTES_PER_CELL  = 32    # Memory per cell while a tile is binned: elevation, bin index, weight and NoData mask.
+
+
+def stage_list(startElev_feet, endElev_feet, incElev_feet, numDecimals):
+    """Return the reference plane elevations, in feet, visited by the stage loop.
+
+    The values are generated exactly as the original while loop did, rounding
+    after every increment, so that the written refElev_feet column does not
+    change."""
+    incElev_feet = round(incElev_feet, numDecimals)
+    if incElev_feet <= 0:
+        raise ValueError("Elevation increment must be greater than zero after rounding to %i decimals" % numDecimals)
+
+    stages = []
+    refElev_feet = round(startElev_feet, numDecimals)   # Round to prevent deviations due to using floating point values.
+    while refElev_feet <= endElev_feet:
+        stages.append(refElev_feet)
+        refElev_feet = round(refElev_feet + incElev_feet, numDecimals) # Round to avoid deviations due to floating point values.
+    return stages
+
+
+class StageAccumulator(object):
+    """Cumulative elevation histogram for a fixed list of reference plane elevations.
+
+    Cell elevations can be added in any number of blocks; each block is binned
+    against the reference planes and only the per-bin cell count and elevation
+    sum are kept, so memory is bounded by the number of stages and not by the
+    number of cells."""
+
+    def __init__(self, stages_feet, refPlane, zFact, cell_area):
+        refPlane = refPlane.upper()
+        if refPlane not in REF_PLANES:
+            raise ValueError("Reference plane must be ABOVE or BELOW, not %s" % refPlane)
+
+        self.refPlane  = refPlane
+        self.zFact     = float(zFact)
+        self.cell_area = float(cell_area)                                   # Square meters per cell.
+        self.planes    = numpy.asarray(stages_feet, dtype=numpy.float64) / FEET_PER_METER
+        # Elevations are summed relative to the first reference plane to keep the sums well conditioned.
+        self.base      = self.planes[0] if len(self.planes) else 0.0
+
+        nbins = len(self.planes) + 1
+        self.counts = numpy.zeros(nbins, dtype=numpy.int64)
+        self.sums   = numpy.zeros(nbins, dtype=numpy.float64)
+
+    def bin_elevations(self, z):
+        """Bin valid cell elevations (meters, no NaN) against the reference planes.
+
+        Returns (bins, weights): the bin of every cell and its elevation
+        relative to the base, both after applying zFact."""
+        if self.zFact != 1.0:
+            z = z * self.zFact
+
+        # Bin k holds the cells that first contribute (BELOW) or last contribute (ABOVE) at plane k.
+        #    BELOW: a cell counts for every plane strictly greater than its elevation.
+        #    ABOVE: a cell counts for every plane strictly less than its elevation.
+        if self.refPlane == "BELOW":
+            bins = numpy.searchsorted(self.planes, z, side="right")
+        else:
+            bins = numpy.searchsorted(self.planes, z, side="left")
+        return bins, z - self.base
+
+    def add(self, z):
+        """Add a block of cell elevations (meters).  NaN marks NoData cells."""
+        z = numpy.asarray(z, dtype=numpy.float64).ravel()
+        z = z[~numpy.isnan(z)]
+        if z.size == 0:
+            return
+
+        bins, weights = self.bin_elevations(z)
+        nbins = len(self.counts)
+        self.counts += numpy.bincount(bins, minlength=nbins)
+        self.sums   += numpy.bincount(bins, weights=weights, minlength=nbins)
+
+    def merge(self, other):
+        """Add the histogram of another accumulator built for the same stages."""
+        self.counts += other.counts
+        self.sums   += other.sums
+
+    def result(self):
+        """Return (vol3d_acft, area2d_ac) arrays with one value per reference plane."""
+        planes = self.planes - self.base
+        cum_counts = numpy.cumsum(self.counts)[:-1]
+        cum_sums   = numpy.cumsum(self.sums)[:-1]
+
+        if self.refPlane == "BELOW":
+            ncells = cum_counts
+            vol_m3 = ncells * planes - cum_sums
+        else:
+            ncells = self.counts.sum() - cum_counts
+            vol_m3 = (self.sums.sum() - cum_sums) - ncells * planes
+
+        vol_m3    = numpy.maximum(vol_m3, 0.0) * self.cell_area          # Clip round-off below an empty plane.
+        area2d_m2 = ncells * self.cell_area
+
+        return vol_m3 / CU_METERS_PER_ACRE_FOOT, area2d_m2 / SQ_METERS_PER_ACRE
+
+
+def tile_shape(nrows, ncols, tile_mb=DEFAULT_TILE_MB):
+    """Rows and columns of a DEM tile that fits in tile_mb megabytes."""
+    cells = max(int(float(tile_mb or DEFAULT_TILE_MB) * 1024 * 1024 / BYTES_PER_CELL), 1)
+    if cells >= ncols:
+        return min(nrows, cells // ncols), ncols       # Strips of whole rows.
+    return 1, cells                                    # Very wide raster: blocks of one row.
+
+
+def read_block(raster, row, col, nrows, ncols):
+    """Read a block of a raster as float64 with NoData set to NaN.
+
+    row and col are counted from the upper left cell of the raster."""
+    import arcpy
+
+    if row == 0 and col == 0 and nrows == raster.height and ncols == raster.width:
+        z = arcpy.RasterToNumPyArray(raster)
+    else:
+        # Lower left corner of the block, moved a quarter cell inside it so it cannot snap to a neighbouring cell.
+        x = raster.extent.XMin + (col + 0.25) * raster.meanCellWidth
+        y = raster.extent.YMax - (row + nrows - 0.25) * raster.meanCellHeight
+        z = arcpy.RasterToNumPyArray(raster, arcpy.Point(x, y), ncols, nrows)
+
+    nodata = None
+    if raster.noDataValue is not None:
+        nodata = z == raster.noDataValue
+    z = numpy.asarray(z, dtype=numpy.float64)
+    if nodata is not None:
+        z[nodata] = numpy.nan
+    return z
+
+
+def dem_tiles(raster, tile_mb=DEFAULT_TILE_MB):
+    """Yield the raster in tiles (float64 arrays, NaN for NoData), including the partial tiles at the edges."""
+    nrows, ncols = raster.height, raster.width
+    tile_rows, tile_cols = tile_shape(nrows, ncols, tile_mb)
+    for row in range(0, nrows, tile_rows):
+        for col in range(0, ncols, tile_cols):
+            yield read_block(raster, row, col, min(tile_rows, nrows - row), min(tile_cols, ncols - col))
+
+
+def numpy_volume_table(inDEM, stages_feet, refPlane, zFact, tile_mb=DEFAULT_TILE_MB):
+    """NUMPY engine: one tiled read of the DEM and one histogram sweep over all stages."""
+    import arcpy
+
+    raster = arcpy.Raster(inDEM)
+    acc = StageAccumulator(stages_feet, refPlane, zFact, raster.meanCellWidth * raster.meanCellHeight)
+    for z in dem_tiles(raster, tile_mb):
+        acc.add(z)
+    return acc.result()
+
+
+def surface_volume(inDEM, refElev_feet, refPlane, zFact):
+    """Run SurfaceVolume_3d for one stage.  Returns (vol3d_acft, area2d_ac)."""
+    import arcpy
+
+    refElev_meters = refElev_feet/FEET_PER_METER        # Reference plane elevation converted to meters.
+    arcpy.env.overwriteOutput = True                    # Needed to append each new record to the output file.
+
+    # Run the SurfaceVolume_3d program with the user-defined values.
+    arcpy.SurfaceVolume_3d(inDEM, "", refPlane, refElev_meters, zFact)
+
+    # Obtain the values or 2D Area and Volume reported by SurfaceVolume_3d
+    #    by searching through the output message results string.
+    parse_start = time.time()
+    r = arcpy.GetMessage(2)
+    area2d_m2 = float(r[r.find("2D Area=") + 8:r.find("3D Area=")])
+    vol3d_m3  = float(r[r.find("Volume=")+7:])
+    stagelookup_metrics.TIMER.add(1, time.time() - parse_start)
+
+    return vol3d_m3 / CU_METERS_PER_ACRE_FOOT, area2d_m2 / SQ_METERS_PER_ACRE
+
+
+def surface_volume_table(inDEM, stages_feet, refPlane, zFact):
+    """SURFACEVOLUME engine: one SurfaceVolume_3d call per stage."""
+    vol3d_acft = numpy.zeros(len(stages_feet))
+    area2d_ac  = numpy.zeros(len(stages_feet))
+    for i, refElev_feet in enumerate(stages_feet):
+        vol3d_acft[i], area2d_ac[i] = surface_volume(inDEM, refElev_feet, refPlane, zFact)
+    return vol3d_acft, area2d_ac
+
+
+def volume_table(inDEM, stages_feet, refPlane, zFact, engine="NUMPY", tile_mb=DEFAULT_TILE_MB, tolerance=None):
+    """Compute (vol3d_acft, area2d_ac) for every stage with the requested engine.
+
+    tile_mb is the memory budget of one DEM tile, for the NUMPY engine and
+    for the elevation range read by the ADAPTIVE engine.  tolerance is the
+    interpolation tolerance (acres and acre-feet) of the ADAPTIVE engine."""
+    engine = (engine or "NUMPY").upper()
+    if engine == "NUMPY":
+        return numpy_volume_table(inDEM, stages_feet, refPlane, zFact, tile_mb)
+    elif engine == "SURFACEVOLUME":
+        return surface_volume_table(inDEM, stages_feet, refPlane, zFact)
+    elif engine == "ADAPTIVE":
+        import stagelookup_adaptive
+        return stagelookup_adaptive.adaptive_volume_table(inDEM, stages_feet, refPlane, zFact, tolerance, tile_mb=tile_mb)
+    raise ValueError("Unknown stage-volume engine %s, expected one of %s" % (engine, ", ".join(ENGINES)))
+
+
+def header_line(inDEM_list_fullpath):
+    """First record of a StageLookup file."""
+    return "%s%s%s  %s,  %s,  %s,  %s,  %s,  %s\r\n" % ("Input DEM list=  ",inDEM_list_fullpath,";  Columns= ","parc_number",\
+       "refElev_feet","not_used", "not_used", "Volume_acft", "2D_Area_ac")
+
+
+def format_row(parc_number, refElev_feet, vol3d_acft, area2d_ac):
+    """One StageLookup data record, without the CRLF line ending."""
+    return "%i,  %f,  %s,  %s,  %f,  %f" % (parc_number,refElev_feet,"not_used", "not_used", vol3d_acft,area2d_ac)
+
+
+def format_rows(parc_number, stages_feet, vol3d_acft, area2d_ac):
+    """All StageLookup data records of one parcel, CRLF terminated.
+
+    The whole block is formatted with one % operation over the interleaved
+    columns; the records are the same as format_row's."""
+    n = len(stages_feet)
+    values = [parc_number, 0.0, "not_used", "not_used", 0.0, 0.0] * n
+    values[1::6] = numpy.asarray(stages_feet, dtype=numpy.float64).tolist()
+    values[4::6] = numpy.asarray(vol3d_acft, dtype=numpy.float64).tolist()
+    values[5::6] = numpy.asarray(area2d_ac, dtype=numpy.float64).tolist()
+    return ("%i,  %f,  %s,  %s,  %f,  %f\r\n" * n) % tuple(values)
@@ -0,0 +1,167 @@
+######################################################################################################################################
+# $Id: stagelookup_journal.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Checkpoint/resume journal for multi-hour StageLookup runs.
+#
+#           The journal is a small text file written next to the output file (StageLookup<datum>.txt.journal).
+#           Every record is flushed to disk before the run moves on:
+#              RUN   <key>                              Hash of the run parameters (DEM list, stages, refPlane, zFact, engine).
+#              START <offset>                           Output file size after the header line.
+#              DONE  <index> <parc_number> <offset>     Parcel completed; output file size after its records.
+#              FAIL  <index> <parc_number> <offset> <message>
+#           When a run writes one file per vertical datum (stagelookup_datum.py), <offset> lists the size of every output
+#           file, comma separated, in the order of the files.
+#
+#           Within a parcel, the SURFACEVOLUME engine appends every finished stage to a per-parcel checkpoint file
+#           in StageLookup<datum>.txt.parcels, so the last stage finished survives a crash as well.
+#
+#           In resume mode the output file is truncated back to the last journaled offset (dropping any records written
+#           after the last checkpoint), finished and failed parcels are skipped, an interrupted parcel continues from
+#           its last finished stage, and new records are appended.  A resumed run therefore writes the same file as an
+#           uninterrupted one.  The parcels that failed are reported at the end of the run and written to
+#           StageLookup<datum>.txt.failed.csv, in the format of the input list of DEMs, so only those can be re-run.
+#
+######################################################################################################################################
+
+import os, shutil, hashlib
+import stagelookup_writer
+
+
+def run_key(*params):
+    """Hash of the run parameters used to match a journal to a run."""
+    return hashlib.md5(repr(params)).hexdigest()
+
+
+class RunJournal(object):
+    """Journal of the parcels completed in one StageLookup run."""
+
+    def __init__(self, outFile, key, resume=False, datum_outFiles=()):
+        self.outFile      = outFile
+        self.outFiles     = [outFile] + list(datum_outFiles)    # Output files written in step, one per datum.
+        self.path         = outFile + ".journal"
+        self.block_folder = outFile + ".parcels"       # Per-parcel checkpoint and block files.
+        self.failed_path  = outFile + ".failed.csv"
+        self.key          = key
+        self.resumed      = False
+        self.offset       = None                       # Output sizes at the last checkpoint.
+        self.done         = set()                      # Indices of parcels finished (completed or failed).
+        self.failed       = []                         # (index, parc_numSTR, inDEM, message)
+
+        if resume and os.path.exists(self.path):
+            self._load()
+            self.resumed = self.offset is not None
+
+    def _load(self):
+        """Read back the records of a previous run with the same key."""
+        f = open(self.path, "r")
+        lines = f.readlines()
+        f.close()
+
+        for line in lines:
+            if not line.endswith("\n"):
+                break                                  # Record cut short by a crash.
+            fields = line.rstrip("\n").split(" ", 4)
+            if fields[0] == "RUN":
+                if fields[1] != self.key:
+                    raise ValueError("Journal %s belongs to a run with different parameters; "
+                                     "resume with the original parameters or run without resume" % self.path)
+            elif fields[0] == "START":
+                self.offset = self._offsets(fields[1])
+            elif fields[0] == "DONE":
+                self.done.add(int(fields[1]))
+                self.offset = self._offsets(fields[3])
+            elif fields[0] == "FAIL":
+                self.done.add(int(fields[1]))
+                self.failed.append((int(fields[1]), fields[2], None, fields[4] if len(fields) > 4 else ""))
+                self.offset = self._offsets(fields[3])
+
+    def _offsets(self, field):
+        offsets = [int(x) for x in field.split(",")]
+        if len(offsets) != len(self.outFiles):
+            raise ValueError("Journal %s belongs to a run with a different number of output files" % self.path)
+        return offsets
+
+    def _record(self, *fields):
+        f = open(self.path, "a")
+        f.write(" ".join([str(x) for x in fields]) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    def open_output(self, header, compress=False):
+        """Open the output file for writing, either from scratch or where the previous run left off.
+
+        With datum_outFiles, returns the list of output files, one per datum.
+        The files are opened in binary mode, so the offsets in the journal are
+        byte offsets and the bytes written are the same with and without
+        compress.  With compress, every write is a gzip member
+        (stagelookup_writer.GzipMemberFile)."""
+        outputs = []
+        if self.resumed:
+            for outFile, offset in zip(self.outFiles, self.offset):
+                output = open(outFile, "r+b")
+                output.truncate(offset)                 # Drop records written after the last checkpoint.
+                output.seek(0, 2)
+                outputs.append(output)
+        else:
+            if os.path.exists(self.block_folder):
+                shutil.rmtree(self.block_folder, ignore_errors=True)
+            for outFile in self.outFiles:
+                output = open(outFile, "wb")            # Binary: the records end in \r\n on every platform.
+                outputs.append(output)
+        if compress:
+            outputs = [stagelookup_writer.GzipMemberFile(output) for output in outputs]
+
+        if not self.resumed:
+            for output in outputs:
+                output.write(header)
+            f = open(self.path, "w")
+            f.close()
+            self._record("RUN", self.key)
+            self._record("START", self._sync(outputs))
+
+        if len(outputs) == 1:
+            return outputs[0]
+        return outputs
+
+    def _sync(self, output):
+        """Flush the output files to disk and return their sizes."""
+        if not isinstance(output, list):
+            output = [output]
+        for f in output:
+            f.flush()
+            os.fsync(f.fileno())
+        return ",".join([str(f.tell()) for f in output])
+
+    def block_file(self, index):
+        """Block file of one parcel, kept until the parcel is journaled as done."""
+        if not os.path.exists(self.block_folder):
+            os.makedirs(self.block_folder)
+        return os.path.join(self.block_folder, "parcel_%05i.txt" % index)
+
+    def parcel_done(self, index, parc_numSTR, output):
+        self._record("DONE", index, parc_numSTR, self._sync(output))
+        self.done.add(index)
+
+    def parcel_failed(self, index, parc_numSTR, inDEM, msg, output):
+        msg = " ".join(str(msg).split())               # Keep the record on one line.
+        self._record("FAIL", index, parc_numSTR, self._sync(output), msg)
+        self.done.add(index)
+        self.failed.append((index, parc_numSTR, inDEM, msg))
+
+    def finish(self, parcels):
+        """Remove the checkpoint files and write the list of failed parcels.
+
+        Returns the failed parcels as (parc_numSTR, inDEM, message)."""
+        shutil.rmtree(self.block_folder, ignore_errors=True)
+
+        failed = [(parc_numSTR, inDEM or parcels[index][1], msg) for index, parc_numSTR, inDEM, msg in sorted(self.failed)]
+        if os.path.exists(self.failed_path):
+            os.remove(self.failed_path)
+        if failed:
+            f = open(self.failed_path, "w")
+            for parc_numSTR, inDEM, msg in failed:
+                f.write("%s,%s\n" % (parc_numSTR, os.path.basename(inDEM)))
+            f.close()
+        return failed
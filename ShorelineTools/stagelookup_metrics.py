@@ -0,0 +1,193 @@
+######################################################################################################################################
+# $Id: stagelookup_metrics.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Run instrumentation: per-parcel timing, throughput, ETA, rate-limited progress messages and a metrics file.
+#
+#           Every parcel is timed from the start of its computation to the end of its checkpoint, and its time is split
+#           into
+#              compute   the stage-volume engine (reading the DEM, SurfaceVolume_3d calls, interpolation)
+#              parse     reading the 2D area and volume out of arcpy.GetMessage(2) after each SurfaceVolume_3d call
+#              write     formatting and writing the records to the output file(s), the per-stage checkpoint file and
+#                        the journal
+#           Only the stages computed in this run are counted as stage evaluations: stages taken from the result cache,
+#           or from the per-stage checkpoint file of an interrupted parcel, are counted as reused, so they do not
+#           inflate the throughput.  Per-stage latencies are these times divided by the number of stages computed, and
+#           the estimated time to finish is the mean time per parcel so far times the parcels left.  The output is written
+#           on the writer thread (stagelookup_writer.py) and, in parallel mode, parcels are computed and formatted in the
+#           worker processes, so the times of the parcels add up to more than the elapsed time.  In zonal mode all
+#           parcels come from one read of the rasters, which is counted with the first parcel.
+#
+#           Instead of every record, the screen shows the heading of each parcel and, at most every PROGRESS_INTERVAL
+#           seconds, the parcels done, stages computed and reused, stage evaluations per second and the estimated time to
+#           finish.  At the
+#           end of the run a summary is written to the screen and the totals and per-parcel times are written to
+#           StageLookup<datum>.txt.metrics.json.
+#
+######################################################################################################################################
+
+import time, json
+
+PROGRESS_INTERVAL = 30.0    # Seconds between progress messages.
+
+
+class StageTimer(object):
+    """Backend calls, message parsing and write time, and stages reused, of the parcel being computed in this process."""
+
+    def __init__(self):
+        self.calls  = 0
+        self.parse  = 0.0
+        self.write  = 0.0
+        self.reused = 0
+
+    def add(self, calls=0, parse=0.0, write=0.0, reused=0):
+        self.calls  += calls
+        self.parse  += parse
+        self.write  += write
+        self.reused += reused
+
+    def take(self):
+        """Return (calls, parse, write, reused) and reset, at the start and end of every parcel."""
+        counts = (self.calls, self.parse, self.write, self.reused)
+        self.calls, self.parse, self.write, self.reused = 0, 0.0, 0.0, 0
+        return counts
+
+TIMER = StageTimer()
+
+
+def timed(function, *args):
+    """Call function(*args) for one parcel.
+
+    Returns (result, timing) where timing is (wall, calls, compute, parse,
+    write, reused): seconds, SurfaceVolume_3d calls, their split and the
+    stages not computed as recorded in TIMER.  If function raises, the
+    exception carries no timing."""
+    TIMER.take()
+    start = time.time()
+    result = function(*args)
+    wall = time.time() - start
+    calls, parse, write, reused = TIMER.take()
+    return result, (wall, calls, max(wall - parse - write, 0.0), parse, write, reused)
+
+
+def _clock(seconds):
+    """Seconds as h:mm:ss."""
+    seconds = int(round(seconds))
+    return "%i:%02i:%02i" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class RunMetrics(object):
+    """Per-parcel times and running throughput of one StageLookup run."""
+
+    def __init__(self, stages_per_parcel, interval=PROGRESS_INTERVAL):
+        self.stages       = stages_per_parcel
+        self.interval     = interval
+        self.parcels      = None                # Parcels to compute in this run, once known.
+        self.records      = []                  # One dict per parcel, in output order.
+        self.start        = time.time()
+        self.last_message = self.start
+
+    def expect(self, parcels):
+        """Number of parcels this run will compute (parcels finished by an earlier run excluded)."""
+        self.parcels = parcels
+
+    def parcel_done(self, parc_numSTR, timing, write, failed=False):
+        """Record a parcel written to the output (or failed).
+
+        timing is (wall, calls, compute, parse, write, reused) from timed(), or
+        None for a parcel computed by an earlier, interrupted run; write is the
+        time spent appending it to the output file(s).  Stages reused from the
+        result cache or a checkpoint file are not counted as computed; with a
+        second datum they are counted in reference planes, at most the stages
+        of the parcel."""
+        wall, calls, compute, parse, checkpoint, reused = timing or (0.0, 0, 0.0, 0.0, 0.0, 0)
+        stages = 0 if failed or timing is None else self.stages
+        reused = min(reused, stages)
+        record = {"parc_number": parc_numSTR, "stages": stages - reused, "stages_reused": reused,
+                  "wall_s": wall + write, "compute_s": compute, "parse_s": parse, "write_s": checkpoint + write,
+                  "backend_calls": calls, "failed": failed}
+        self.records.append(record)
+
+        now = time.time()
+        if now - self.last_message >= self.interval or len(self.records) == self.parcels:
+            self.last_message = now
+            self.progress()
+
+    def evaluations(self):
+        """Stage evaluations done so far in this run."""
+        return sum([record["stages"] for record in self.records])
+
+    def reused(self):
+        """Stages taken from the result cache or a checkpoint file so far in this run."""
+        return sum([record["stages_reused"] for record in self.records])
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def rate(self):
+        """Stage evaluations per second since the start of the run."""
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return self.evaluations() / elapsed
+
+    def eta(self):
+        """Estimated seconds to the end of the run, or None while it cannot be estimated.
+
+        Cache hits take less time than computed parcels, so the estimate is
+        the mean time per parcel so far, hits included, times the parcels left."""
+        if self.parcels is None or not self.records:
+            return None
+        return max(self.parcels - len(self.records), 0) * self.elapsed() / len(self.records)
+
+    def progress(self):
+        """Write the progress of the run to the screen."""
+        import arcpy
+        eta = self.eta()
+        arcpy.AddMessage("%s %i %s %s %s, %i %s, %i %s, %.1f %s, %s %s, %s %s" % (
+            "Progress:", len(self.records), "of", "?" if self.parcels is None else self.parcels, "parcels",
+            self.evaluations(), "stages computed", self.reused(), "reused", self.rate(), "stages/s",
+            "elapsed", _clock(self.elapsed()), "ETA", "?" if eta is None else _clock(eta)))
+
+    def totals(self):
+        """Totals of the run, with per-stage latencies in milliseconds."""
+        evaluations = self.evaluations()
+        totals = {"parcels": len(self.records), "failed": len([r for r in self.records if r["failed"]]),
+                  "stages_per_parcel": self.stages, "stage_evaluations": evaluations, "stages_reused": self.reused(),
+                  "elapsed_s": self.elapsed(), "evaluations_per_s": self.rate()}
+        for name in ["wall", "compute", "parse", "write"]:
+            seconds = sum([record[name + "_s"] for record in self.records])
+            totals[name + "_s"] = seconds
+            totals[name + "_ms_per_stage"] = 1000.0 * seconds / evaluations if evaluations else 0.0
+        totals["backend_calls"] = sum([record["backend_calls"] for record in self.records])
+        return totals
+
+    def report_summary(self):
+        """Write the times of this run to the screen."""
+        import arcpy
+        totals = self.totals()
+        arcpy.AddMessage("%s" % (""))  #space out screen messages
+        arcpy.AddMessage("%s" % ("RUN METRICS SUMMARY:"))
+        arcpy.AddMessage("%s %i" % ("   Parcels computed                   =", totals["parcels"] - totals["failed"]))
+        arcpy.AddMessage("%s %i" % ("   Parcels failed                     =", totals["failed"]))
+        arcpy.AddMessage("%s %i" % ("   Stage evaluations                  =", totals["stage_evaluations"]))
+        arcpy.AddMessage("%s %i" % ("   Stages reused                      =", totals["stages_reused"]))
+        arcpy.AddMessage("%s %.1f" % ("   Stage evaluations per second       =", totals["evaluations_per_s"]))
+        arcpy.AddMessage("%s %i" % ("   SurfaceVolume_3d calls             =", totals["backend_calls"]))
+        computed = [record for record in self.records if record["stages"] or record["stages_reused"]]
+        if computed:
+            slowest = max(computed, key=lambda record: record["wall_s"])
+            arcpy.AddMessage("%s %.2f" % ("   Mean time per parcel, in s         =",
+                                          totals["wall_s"] / len(computed)))
+            arcpy.AddMessage("%s %.2f %s" % ("   Slowest parcel, in s               =", slowest["wall_s"],
+                                             "(Parcel Number= " + slowest["parc_number"] + ")"))
+        arcpy.AddMessage("%s %.4f" % ("   Compute per stage, in ms           =", totals["compute_ms_per_stage"]))
+        arcpy.AddMessage("%s %.4f" % ("   Message parsing per stage, in ms   =", totals["parse_ms_per_stage"]))
+        arcpy.AddMessage("%s %.4f" % ("   Write per stage, in ms             =", totals["write_ms_per_stage"]))
+
+    def write(self, path):
+        """Write the totals and the per-parcel times as JSON."""
+        f = open(path, "w")
+        json.dump({"totals": self.totals(), "parcels": self.records}, f, indent=1, separators=(",", ": "), sort_keys=True)
+        f.write("\n")
+        f.close()
@@ -0,0 +1,187 @@
+######################################################################################################################################
+# $Id: stagelookup_query.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Vectorized batch queries, with interpolation, over the StageLookup tables.
+#
+#           The Shoreline Management Tool looks up values at stage increments of 0.01 ft, which forces the 10x more
+#           expensive 0.01 ft generation run.  StageLookupQuery loads a StageLookup text file or binary store
+#           (stagelookup_store.py) and answers arrays of (parcel, stage) queries, such as a whole gauge time series
+#           across all parcels, in a few NumPy operations:
+#              volume_area(parcels, stages)   volume in acre-feet and 2D area in acres between the tabulated stages,
+#                                             so 0.1 ft tables answer 0.01 ft queries: area linearly interpolated,
+#                                             volume integrated from that area (trapezoid).
+#              stage_for_volume(parcels, vol) the inverse query: stage, in feet, at which a parcel holds a volume, on
+#                                             the same volume curve.
+#
+#           All parcels are packed into one set of concatenated arrays; each query is turned into an index into those
+#           arrays with an offset computation (evenly spaced stages), so no per-query Python loop or search is needed
+#           for the forward query.  Stages outside a parcel's table are clamped to the first or last tabulated value.
+#
+######################################################################################################################################
+
+import numpy
+import stagelookup_store
+
+
+class StageLookupQuery(object):
+    """Batch queries over the tables of all parcels."""
+
+    def __init__(self, parcels):
+        """parcels: iterable of (parc_number, stages_feet, vol3d_acft, area2d_ac), stages evenly spaced."""
+        parc_numbers, starts, incs, counts, firsts = [], [], [], [], []
+        stages, volumes, areas = [], [], []
+        first = 0
+        for parc_number, stages_feet, vol3d_acft, area2d_ac in parcels:
+            stages_feet = numpy.asarray(stages_feet, dtype=numpy.float64)
+            n = len(stages_feet)
+            parc_numbers.append(int(parc_number))
+            starts.append(stages_feet[0])
+            incs.append((stages_feet[-1] - stages_feet[0]) / (n - 1) if n > 1 else 0.0)
+            counts.append(n)
+            firsts.append(first)
+            stages.append(stages_feet)
+            volumes.append(numpy.asarray(vol3d_acft, dtype=numpy.float64))
+            areas.append(numpy.asarray(area2d_ac, dtype=numpy.float64))
+            first += n
+
+        self.parc_numbers = numpy.array(parc_numbers, dtype=numpy.int64)
+        self.starts  = numpy.array(starts, dtype=numpy.float64)
+        self.incs    = numpy.array(incs, dtype=numpy.float64)
+        self.counts  = numpy.array(counts, dtype=numpy.int64)
+        self.firsts  = numpy.array(firsts, dtype=numpy.int64)
+        self.stages  = numpy.concatenate(stages) if stages else numpy.zeros(0)
+        self.volumes = numpy.concatenate(volumes) if volumes else numpy.zeros(0)
+        self.areas   = numpy.concatenate(areas) if areas else numpy.zeros(0)
+
+        # Parcel numbers are mapped to table positions with a sorted search.
+        self.order  = numpy.argsort(self.parc_numbers)
+        self.sorted = self.parc_numbers[self.order]
+
+    def positions(self, parcels):
+        """Table position of every parcel number in an array; raises KeyError for unknown parcels."""
+        parcels = numpy.asarray(parcels, dtype=numpy.int64)
+        i = numpy.clip(numpy.searchsorted(self.sorted, parcels), 0, max(len(self.sorted) - 1, 0))
+        if len(self.sorted) == 0 or (self.sorted[i] != parcels).any():
+            missing = numpy.setdiff1d(parcels, self.sorted)
+            raise KeyError("Parcels not in the stage lookup tables: %s" % ", ".join([str(x) for x in missing[:10]]))
+        return self.order[i]
+
+    def _locate(self, parcels, stages_feet):
+        """Table interval of every (parcel, stage) pair: indices j and k of the tabulated stages on either side of
+        the stage, and its fraction w of the way from j to k."""
+        parcels, stages_feet = numpy.broadcast_arrays(numpy.asarray(parcels), numpy.asarray(stages_feet, dtype=numpy.float64))
+        p = self.positions(parcels.ravel())
+        s = stages_feet.ravel()
+
+        n   = self.counts[p]
+        inc = numpy.where(self.incs[p] > 0, self.incs[p], 1.0)
+        x   = numpy.clip((s - self.starts[p]) / inc, 0, n - 1)            # Fractional index into the parcel table.
+        i   = numpy.minimum(numpy.floor(x).astype(numpy.int64), numpy.maximum(n - 2, 0))
+        w   = numpy.where(n > 1, x - i, 0.0)
+        j   = self.firsts[p] + i
+        k   = self.firsts[p] + numpy.minimum(i + 1, n - 1)
+        return parcels.shape, j, k, w
+
+    def _interpolate(self, parcels, stages_feet, values):
+        shape, j, k, w = self._locate(parcels, stages_feet)
+        return ((1 - w) * values[j] + w * values[k]).reshape(shape)
+
+    def _trapezoid(self, j, k):
+        """Coefficients of the volume curve over table intervals j-k: V(d) = V_j + b*d + c*d**2, d in feet from
+        stage j.
+
+        The area is linear over the interval, so the volume is its integral
+        V_j +/- (A_j*d + (A_k - A_j)*d**2/(2h)), + for a volume rising with
+        stage (refPlane BELOW) and - for a falling one (ABOVE).  What the
+        trapezoid leaves of V_k - V_j (area not linear over the interval,
+        rounding of the table values) is spread linearly over the interval, so
+        the curve passes through both tabulated volumes.  Where that would
+        make the curve turn back within the interval, as at the dry end of a
+        table, the volume is interpolated linearly instead, so the curve stays
+        monotonic and stage_for_volume() can invert it."""
+        h    = self.stages[k] - self.stages[j]
+        h    = numpy.where(h > 0, h, 1.0)
+        sign = numpy.where(self.volumes[k] < self.volumes[j], -1.0, 1.0)
+        area_j, area_k = self.areas[j], self.areas[k]
+        residual = self.volumes[k] - self.volumes[j] - sign * 0.5 * (area_j + area_k) * h
+        b = sign * area_j + residual / h
+        c = sign * (area_k - area_j) / (2 * h)
+        monotonic = (sign * b >= 0) & (sign * (b + 2 * c * h) >= 0)         # Slope at both ends of the interval.
+        return h, numpy.where(monotonic, b, (self.volumes[k] - self.volumes[j]) / h), numpy.where(monotonic, c, 0.0)
+
+    def _volume(self, parcels, stages_feet):
+        shape, j, k, w = self._locate(parcels, stages_feet)
+        h, b, c = self._trapezoid(j, k)
+        d = w * h
+        return (self.volumes[j] + b * d + c * d * d).reshape(shape)
+
+    def volume_area(self, parcels, stages_feet):
+        """Volume (acre-feet) and 2D area (acres) at each (parcel, stage) pair.
+
+        parcels and stages_feet are arrays of any shape that broadcast together;
+        for example a column of parcel numbers against a row of gauge stages."""
+        return self._volume(parcels, stages_feet), self._interpolate(parcels, stages_feet, self.areas)
+
+    def volume(self, parcels, stages_feet):
+        """Volume, in acre-feet, at each (parcel, stage) pair."""
+        return self._volume(parcels, stages_feet)
+
+    def area(self, parcels, stages_feet):
+        """2D area, in acres, at each (parcel, stage) pair."""
+        return self._interpolate(parcels, stages_feet, self.areas)
+
+    def stage_for_volume(self, parcels, vol3d_acft):
+        """Stage, in feet, at which each parcel holds the given volume (acre-feet).
+
+        The tables must be monotonic in volume (rising for refPlane BELOW,
+        falling for ABOVE).  The stage is found on the volume curve of
+        volume_area(), so the two queries invert each other.  Flat stretches of
+        a table return their lowest stage; volumes outside the table are
+        clamped to the first or last stage."""
+        parcels, vol3d_acft = numpy.broadcast_arrays(numpy.asarray(parcels), numpy.asarray(vol3d_acft, dtype=numpy.float64))
+        p = self.positions(parcels.ravel())
+        v = vol3d_acft.ravel()
+        stages = numpy.empty(len(v))
+
+        # One vectorized search over all the queries of each parcel.
+        for q in numpy.unique(p):
+            sel   = numpy.nonzero(p == q)[0]
+            first = self.firsts[q]
+            table = self.volumes[first:first + self.counts[q]]
+            x     = self.stages[first:first + self.counts[q]]
+            if len(table) == 1:
+                stages[sel] = x[0]
+                continue
+            sign = -1.0 if table[-1] < table[0] else 1.0        # ABOVE: volume falls as stage rises.
+
+            # Table interval of each volume, then the stage on the volume curve of volume_area() within it.
+            i = numpy.clip(numpy.searchsorted(sign * table, sign * v[sel], side="left"), 1, len(table) - 1)
+            j = first + i - 1
+            h, b, c = self._trapezoid(j, j + 1)
+            t = numpy.clip(sign * (v[sel] - self.volumes[j]), 0, sign * (self.volumes[j + 1] - self.volumes[j])) * sign
+            # Root of c*d**2 + b*d - t = 0 nearest d = 0, in the form that does not cancel when c is small.
+            root  = numpy.sqrt(numpy.maximum(b * b + 4 * c * t, 0.0))
+            denom = b + numpy.where(b < 0, -root, root)
+            d = numpy.where(denom != 0, 2 * t / numpy.where(denom != 0, denom, 1.0), 0.0)
+            stages[sel] = x[i - 1] + numpy.clip(d, 0, h)
+        return stages.reshape(parcels.shape)
+
+
+def load_text(path):
+    """StageLookupQuery over a StageLookup text file."""
+    header, parcels = stagelookup_store.read_text(path)
+    return StageLookupQuery(parcels)
+
+
+def load_store(path):
+    """StageLookupQuery over a binary store."""
+    store = stagelookup_store.StageLookupStore(path)
+    return StageLookupQuery([(parc_number,) + store.parcel(parc_number) for parc_number in store.parcel_numbers])
+
+
+def load(path):
+    """StageLookupQuery over a text file or, for a .bin path, a binary store."""
+    if path.lower().endswith(".bin"):
+        return load_store(path)
+    return load_text(path)
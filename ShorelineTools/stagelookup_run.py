@@ -0,0 +1,531 @@
+######################################################################################################################################
+# $Id: stagelookup_run.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Parcel loop and run setup shared by Create_Stagelookup_Data_Table_v2.py and the Create Stage Lookup Python toolbox.
+#
+#           Parcels can be processed one after another (workers = 1) or spread across a process pool (workers > 1,
+#           or 0 for one worker per CPU).  In parallel mode every worker writes the values of its parcel to a temporary
+#           block file; the blocks are then appended to the StageLookup file in the order of the input list of DEMs, so
+#           the file is byte-identical to a serial run.  All stage-volume engines (NUMPY, SURFACEVOLUME and ADAPTIVE) can
+#           be used in either mode.
+#
+#           When a RunJournal (stagelookup_journal.py) is given, every parcel is checkpointed as it is appended to the
+#           output file and parcels already finished by an earlier run are skipped.  When a ResultCache
+#           (stagelookup_cache.py) is given, only the stages not in the cache are computed.  When DatumGrids
+#           (stagelookup_datum.py) are given, output is a list of files, one per vertical datum, and every parcel is
+#           computed once for all of them.  When RunMetrics (stagelookup_metrics.py) are given, every parcel is timed
+#           and the progress of the run is written to the screen.
+#
+#           Finished parcels are handed to a BlockWriter (stagelookup_writer.py), which formats, writes and checkpoints
+#           them on a background thread while the next parcel is computed.
+#
+#           create_stage_lookup() is the whole run from the tool parameters (output file names, journal, datums,
+#           cache, metrics, binary store and the report of failed parcels); both entry points read their parameters
+#           and call it.
+#
+######################################################################################################################################
+
+import sys, os, time, shutil, tempfile, multiprocessing
+import numpy
+import arcpy
+import stagelookup_engine, stagelookup_adaptive, stagelookup_metrics, stagelookup_writer
+
+SCREEN_ROWS = False     # Also write every record to the screen (floods the geoprocessing window on long runs).
+
+
+def read_dem_list(inDEM_list_fullpath, inDEMpath):
+    """Parse the input list of DEMs.
+
+    Returns a list of (parc_numSTR, inDEM) in file order.  As in the original
+    loop, reading stops at the first blank record."""
+    parcels = []
+    inDEM_list = open(inDEM_list_fullpath, "r")
+    for aLine in inDEM_list:
+        if len(aLine) < 1:
+            break
+        parc_numSTR, inDEMname = aLine.split( "," )
+        if parc_numSTR is None or parc_numSTR == "":
+            break
+        parcels.append((parc_numSTR, os.path.join(inDEMpath,inDEMname.strip())))
+    inDEM_list.close()
+    return parcels
+
+
+def parcel_block(parc_numSTR, inDEM, stages_feet, refPlane, zFact, engine, checkpoint_file=None, tile_mb=None,
+                 tolerance=None, cache=None, datums=None):
+    """Compute every stage of one parcel and return its block.
+
+    The block is (parc_number, stages_feet, vol3d_acft, area2d_ac), formatted
+    later by the writer (stagelookup_writer.format_block).  With a
+    checkpoint_file the SURFACEVOLUME engine appends each finished stage to
+    that file and, if it already holds records, continues after the last one;
+    the block is then the formatted records.  With a cache the stages are
+    looked up there first; with datums a list of blocks, one per datum, is
+    returned.  The per-stage checkpoint is not used with either."""
+    if datums is not None:
+        planes_feet, grids = datums.grids(stages_feet, parc_numSTR)
+        vol3d_acft, area2d_ac = _volume_table(inDEM, planes_feet, refPlane, zFact, engine, tile_mb, tolerance, cache)
+        return datums.tables(int(parc_numSTR), grids, vol3d_acft, area2d_ac)
+    if cache is not None:
+        vol3d_acft, area2d_ac = _volume_table(inDEM, stages_feet, refPlane, zFact, engine, tile_mb, tolerance, cache)
+        return int(parc_numSTR), stages_feet, vol3d_acft, area2d_ac
+    if checkpoint_file is not None and (engine or "NUMPY").upper() == "SURFACEVOLUME":
+        return _checkpointed_surface_volume_block(parc_numSTR, inDEM, stages_feet, refPlane, zFact, checkpoint_file)
+    vol3d_acft, area2d_ac = stagelookup_engine.volume_table(inDEM, stages_feet, refPlane, zFact, engine, tile_mb,
+                                                         tolerance)
+    return int(parc_numSTR), stages_feet, vol3d_acft, area2d_ac
+
+
+def _volume_table(inDEM, stages_feet, refPlane, zFact, engine, tile_mb, tolerance, cache):
+    """stagelookup_engine.volume_table, through the cache when there is one."""
+    if cache is not None:
+        return cache.volume_table(inDEM, stages_feet, refPlane, zFact, engine, tile_mb, tolerance)
+    return stagelookup_engine.volume_table(inDEM, stages_feet, refPlane, zFact, engine, tile_mb, tolerance)
+
+
+def _checkpointed_surface_volume_block(parc_numSTR, inDEM, stages_feet, refPlane, zFact, checkpoint_file):
+    """SURFACEVOLUME engine with a per-stage checkpoint file."""
+    finished = ""
+    if os.path.exists(checkpoint_file):
+        f = open(checkpoint_file, "rb")
+        finished = f.read()
+        f.close()
+        finished = finished[:finished.rfind("\r\n") + 2]   # Drop a record cut short by a crash.
+
+    f = open(checkpoint_file, "wb")
+    f.write(finished)
+    stagelookup_metrics.TIMER.add(reused=finished.count("\r\n"))
+    parc_number = int(parc_numSTR)
+    for refElev_feet in stages_feet[finished.count("\r\n"):]:
+        vol3d_acft, area2d_ac = stagelookup_engine.surface_volume(inDEM, refElev_feet, refPlane, zFact)
+        write_start = time.time()
+        f.write("%s\r\n" % stagelookup_engine.format_row(parc_number, refElev_feet, vol3d_acft, area2d_ac))
+        f.flush()
+        os.fsync(f.fileno())
+        stagelookup_metrics.TIMER.add(write=time.time() - write_start)
+    f.close()
+
+    f = open(checkpoint_file, "rb")
+    block = f.read()
+    f.close()
+    return block
+
+
+def report_parcel(parc_numSTR, inDEM, block):
+    """Write the parcel heading, and its records if SCREEN_ROWS is set, to the screen."""
+    arcpy.AddMessage("%s, %s" % ("Parcel Number= " + parc_numSTR,"Input DEM= "+ inDEM))
+    if SCREEN_ROWS:
+        for row in stagelookup_writer.format_block(block).splitlines():
+            arcpy.AddMessage(row)
+
+
+def queue_block(writer, index, parc_numSTR, inDEM, block, timing=None, remove_files=()):
+    """Report a finished parcel and queue it on the writer."""
+    report_parcel(parc_numSTR, inDEM, block[0] if isinstance(writer.output, list) else block)
+    writer.append(index, parc_numSTR, inDEM, block, timing, remove_files)
+
+
+def _parcel_failed(writer, index, parc_numSTR, inDEM, msg, remove_files=()):
+    """Report a parcel that could not be computed and queue its checkpoint."""
+    report_parcel(parc_numSTR, inDEM, "")
+    arcpy.AddMessage(str(msg))
+    writer.failed(index, parc_numSTR, inDEM, msg, remove_files)
+
+
+def _skip_finished(parcels, journal):
+    """(index, parc_numSTR, inDEM) of the parcels not finished by an earlier run."""
+    todo = []
+    for index, (parc_numSTR, inDEM) in enumerate(parcels):
+        if journal is not None and index in journal.done:
+            arcpy.AddMessage("%s, %s" % ("Parcel Number= " + parc_numSTR,"already finished in journal, skipped"))
+            continue
+        todo.append((index, parc_numSTR, inDEM))
+    return todo
+
+
+def run_serial(parcels, output, stages_feet, refPlane, zFact, engine, journal=None, tile_mb=None, tolerance=None,
+               cache=None, datums=None, metrics=None, store=None):
+    """Process the parcels one after another, appending each parcel to output."""
+    todo = _skip_finished(parcels, journal)
+    if metrics is not None:
+        metrics.expect(len(todo))
+    writer = stagelookup_writer.BlockWriter(output, journal, metrics, store)
+    try:
+        for index, parc_numSTR, inDEM in todo:
+            checkpoint_file = journal.block_file(index) + ".partial" if journal is not None else None
+            remove_files = [checkpoint_file] if checkpoint_file is not None else []
+            try:
+                block, timing = stagelookup_metrics.timed(parcel_block, parc_numSTR, inDEM, stages_feet, refPlane, zFact,
+                                                          engine, checkpoint_file, tile_mb, tolerance, cache, datums)
+            except Exception, msg:
+                _parcel_failed(writer, index, parc_numSTR, inDEM, msg, remove_files)
+                continue
+            queue_block(writer, index, parc_numSTR, inDEM, block, timing, remove_files)
+    finally:
+        writer.close()
+
+
+def _init_worker(engine):
+    """Process pool initializer."""
+    if (engine or "NUMPY").upper() in ["SURFACEVOLUME", "ADAPTIVE"]:
+        arcpy.CheckOutExtension("3D") # Each worker process needs its own 3D extension license.
+
+
+def _parcel_worker(args):
+    """Process pool task: compute one parcel and write it to its own block file.
+
+    A block file left by an interrupted run is reused as is.
+    Returns (block_file, error_message, adaptive_counts, cache_counts, timing);
+    exactly one of the first two is None.  The counts of the ADAPTIVE engine
+    and of the cache, and the timing of the parcel, are handed back to the
+    parent for the summaries."""
+    block_file, parc_numSTR, inDEM, stages_feet, refPlane, zFact, engine, checkpoint, tile_mb, tolerance, cache, datums = args
+    if os.path.exists(block_file):
+        return block_file, None, (0, 0), None, None
+    try:
+        checkpoint_file = block_file + ".partial" if checkpoint else None
+        block, timing = stagelookup_metrics.timed(parcel_block, parc_numSTR, inDEM, stages_feet, refPlane, zFact, engine,
+                                                  checkpoint_file, tile_mb, tolerance, cache, datums)
+        if isinstance(block, list):
+            for k in range(len(block) - 1, -1, -1):          # The file of the first datum, written last, marks the parcel done.
+                _write_block_file(_datum_block_file(block_file, k), block[k])
+        else:
+            _write_block_file(block_file, block)
+        if checkpoint_file is not None and os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        return block_file, None, stagelookup_adaptive.STATS.take(), cache and cache.take(), timing
+    except Exception, msg:
+        return None, str(msg), stagelookup_adaptive.STATS.take(), cache and cache.take(), None
+
+
+def _datum_block_file(block_file, k):
+    """Block file of the k-th datum of a parcel."""
+    if k == 0:
+        return block_file
+    return "%s.%i" % (block_file, k)
+
+
+def _write_block_file(block_file, block):
+    """Write the block of one parcel: its stages, volumes and areas as a float64 .npy array, or formatted records as is."""
+    f = open(block_file + ".tmp", "wb")   # Binary: the block is appended later through the output file object.
+    if isinstance(block, tuple):
+        numpy.save(f, numpy.array(block[1:], dtype=numpy.float64))
+    else:
+        f.write(block)
+    f.close()
+    os.rename(block_file + ".tmp", block_file)
+
+
+def _read_block_file(block_file, parc_numSTR):
+    """Block of one parcel written by _write_block_file."""
+    f = open(block_file, "rb")
+    if f.read(6) == "\x93NUMPY":
+        f.seek(0)
+        stages_feet, vol3d_acft, area2d_ac = numpy.load(f)
+        block = int(parc_numSTR), stages_feet, vol3d_acft, area2d_ac
+    else:
+        f.seek(0)
+        block = f.read()
+    f.close()
+    return block
+
+
+def _create_pool(workers, engine):
+    """Start the process pool without letting the workers re-run the calling script.
+
+    On Windows each worker imports the __main__ module by file name.  The
+    stand-alone script has no __main__ guard and ArcMap is not a python
+    executable, so hide the main file and point multiprocessing at pythonw."""
+    if os.name == "nt" and not os.path.basename(sys.executable).lower().startswith("python"):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe"))
+
+    main = sys.modules["__main__"]
+    main_file = getattr(main, "__file__", None)
+    if main_file is not None:
+        del main.__file__
+    try:
+        return multiprocessing.Pool(workers, _init_worker, (engine,))
+    finally:
+        if main_file is not None:
+            main.__file__ = main_file
+
+
+def run_parallel(parcels, output, stages_feet, refPlane, zFact, engine, workers, temp_folder=None, journal=None, tile_mb=None,
+                 tolerance=None, cache=None, datums=None, metrics=None, store=None):
+    """Process the parcels on a process pool and merge the blocks in input-list order."""
+    todo = _skip_finished(parcels, journal)
+    if metrics is not None:
+        metrics.expect(len(todo))
+    if journal is not None:
+        # Blocks finished out of order are kept with the journal so an interrupted run can reuse them.
+        block_files = [journal.block_file(index) for index, parc_numSTR, inDEM in todo]
+    else:
+        block_folder = tempfile.mkdtemp(prefix="StageLookup_", dir=temp_folder)
+        block_files = [os.path.join(block_folder, "parcel_%05i.txt" % index) for index, parc_numSTR, inDEM in todo]
+    tasks = [(block_file, parc_numSTR, inDEM, stages_feet, refPlane, zFact, engine, journal is not None, tile_mb,
+              tolerance, cache, datums)
+             for block_file, (index, parc_numSTR, inDEM) in zip(block_files, todo)]
+
+    pool = _create_pool(workers, engine)
+    writer = stagelookup_writer.BlockWriter(output, journal, metrics, store)
+    try:
+        # imap hands results back in task order while the workers run ahead on later parcels.
+        for (index, parc_numSTR, inDEM), (block_file, msg, counts, cache_counts, timing) in zip(todo, pool.imap(_parcel_worker, tasks, 1)):
+            stagelookup_adaptive.STATS.add(*counts)
+            if cache_counts:
+                cache.add(cache_counts)
+            if block_file is None:
+                _parcel_failed(writer, index, parc_numSTR, inDEM, msg)
+                continue
+            if isinstance(output, list):
+                datum_files = [_datum_block_file(block_file, k) for k in range(len(output))]
+                block = [_read_block_file(datum_file, parc_numSTR) for datum_file in datum_files]
+                remove_files = datum_files[::-1]                # The file of the first datum last, as it was written.
+            else:
+                block = _read_block_file(block_file, parc_numSTR)
+                remove_files = [block_file]
+            queue_block(writer, index, parc_numSTR, inDEM, block, timing, remove_files)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        try:
+            writer.close()
+        finally:
+            if journal is None:
+                shutil.rmtree(block_folder, ignore_errors=True)
+
+
+def optional_parameter(index, default=""):
+    """Text of script tool parameter index, or default when it is blank or the tool does not pass it.
+
+    The CreateStageLookupDataTable script tool of Shoreline Management
+    Tool.tbx passes only the original parameters 0 to 10; GetParameterAsText
+    fails for an index past the parameters of the tool."""
+    if arcpy.GetArgumentCount() <= index:
+        return default
+    return arcpy.GetParameterAsText(index) or default
+
+
+def resolve_workers(workers):
+    """Number of worker processes: blank means 1 (serial), 0 means one per CPU."""
+    if workers is None or workers == "":
+        return 1
+    workers = int(workers)
+    if workers <= 0:
+        workers = multiprocessing.cpu_count()
+    return workers
+
+
+def run_stage_lookup(parcels, output, stages_feet, refPlane, zFact, engine="NUMPY", workers=1, temp_folder=None, journal=None,
+                     tile_mb=None, tolerance=None, cache=None, datums=None, metrics=None, store=None):
+    """Write the StageLookup records of every parcel to output, serially or on a process pool.
+
+    tile_mb is the memory budget of one DEM tile for the NUMPY engine; in
+    parallel mode every worker reads its own tiles.  tolerance is the
+    interpolation tolerance of the ADAPTIVE engine.  cache is an optional
+    stagelookup_cache.ResultCache.  With stagelookup_datum.DatumGrids, output
+    is the list of output files, one per datum.  metrics is an optional
+    stagelookup_metrics.RunMetrics.  store is an optional
+    stagelookup_store.StageLookupStoreWriter (a list, one per datum, with
+    datums) that every parcel is added to."""
+    workers = min(resolve_workers(workers), max(len(parcels), 1))
+    if workers == 1:
+        run_serial(parcels, output, stages_feet, refPlane, zFact, engine, journal, tile_mb, tolerance, cache, datums,
+                   metrics, store)
+    else:
+        run_parallel(parcels, output, stages_feet, refPlane, zFact, engine, workers, temp_folder, journal, tile_mb,
+                     tolerance, cache, datums, metrics, store)
+
+
+def report_failed(failed):
+    """Write the parcels that failed to the screen."""
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    if not failed:
+        arcpy.AddMessage("%s" % ("All parcels completed."))
+        return
+    arcpy.AddMessage("%s %i" % ("FAILED PARCELS (re-run only these with the .failed.csv list of DEMs):", len(failed)))
+    for parc_numSTR, inDEM, msg in failed:
+        arcpy.AddMessage("%s, %s, %s" % ("Parcel Number= " + parc_numSTR,"Input DEM= "+ inDEM, msg))
+
+
+def create_stage_lookup(inDEM_list_fullpath, inDEMpath, inDEMdatum, out_folder_path, startElev_feet, endElev_feet,
+                        incElev_feet, numDecimals, zFact, refPlane, engine="NUMPY", workers=1, resume=False, tile_mb=None,
+                        inZonalDEM="", inParcelRaster="", binary_store=False, tolerance=None, cache_folder="", cache_mb=None,
+                        outDatum2="", datum_offset="", compress=False, outFile_suffix="", starttime=None):
+    """Run the StageLookup tool from its parameter values: the run shared by Create_Stagelookup_Data_Table_v2.py and
+    the Create Stage Lookup Python toolbox.
+
+    Names the output file(s) StageLookup<datum><outFile_suffix>.txt (.gz with
+    compress), writes the parameters to the screen, sets up the journal,
+    datums, cache and metrics, computes every parcel (input list of DEMs or
+    zonal mode), writes the summaries, metrics file, binary store and failed
+    parcels, and reports the elapsed time since starttime (time.clock()).
+    Returns the list of output files."""
+    import stagelookup_journal, stagelookup_zonal, stagelookup_store, stagelookup_cache, stagelookup_datum  # zonal imports this module.
+
+    if starttime is None:
+        starttime = time.clock()
+    engine    = engine or "NUMPY"
+    workers   = resolve_workers(workers)
+    tile_mb   = float(tile_mb or stagelookup_engine.DEFAULT_TILE_MB)
+    tolerance = float(tolerance or stagelookup_adaptive.DEFAULT_TOLERANCE)
+    cache_mb  = float(cache_mb or stagelookup_cache.DEFAULT_CACHE_MB)
+
+    # Prepare output file.
+    # RYAN COMMENT - Put check to see if file exists in folder.
+    outFile_name   = "StageLookup" + inDEMdatum + outFile_suffix + ".txt"  # Name of output text file of elevation, area, and volume .
+    #                                                             #    WARNING: will overwrite existing file unless resuming.
+    #                                                             # The required naming convention for the data table files are 
+    #                                                             #    StageLookupNAVD88.txt or StageLookupNGVD29.txt, depending on 
+    #                                                             #    vertical datum used, NAVD88 or NGVD 29, respectively. 
+    outFile        = os.path.join(out_folder_path,outFile_name)   # Full path and file name of output file.
+    outFiles       = [outFile]                                    # Output files, one per vertical datum.
+    if outDatum2 != "":
+        outFiles.append(os.path.join(out_folder_path, "StageLookup" + outDatum2 + outFile_suffix + ".txt"))
+    if compress:
+        outFiles = [outFile_datum + ".gz" for outFile_datum in outFiles]   # Decompress to .txt for the Shoreline Management Tool.
+        outFile  = outFiles[0]
+
+    # Write to screen the parameters specified for the run.
+    inDEM_list_path, inDEM_list_name = os.path.split(inDEM_list_fullpath)
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    arcpy.AddMessage("%s" % ("USER-SPECIFIED INPUT PARAMETERS:"))
+    arcpy.AddMessage("%s %s" % ("   Path to folder with file of input list of DEMs (inDEM_list_path)     =", inDEM_list_path))
+    arcpy.AddMessage("%s %s" % ("   Filename of input list of DEMs                 (inDEM_list_name)     =", inDEM_list_name))
+    arcpy.AddMessage("%s %s" % ("   Path to input DEMs                             (inDEMpath)           =", inDEMpath))
+    arcpy.AddMessage("%s %s" % ("   Vertical datum of input DEMs: NAVD88 or NGVD29 (inDEMdatum)          =", inDEMdatum))
+    arcpy.AddMessage("%s %s" % ("   Path to output folder for output text file     (out_folder_path)     =", out_folder_path))
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    arcpy.AddMessage("%s %f" % ("   Starting Elevation, in ft          (startElev_feet) =", startElev_feet))
+    arcpy.AddMessage("%s %f" % ("   Ending   Elevation, in ft          (endElev_feet)   =", endElev_feet))
+    arcpy.AddMessage("%s %f" % ("   Increment, in ft                   (incElev_feet)   =", incElev_feet))
+    arcpy.AddMessage("%s %i" % ("   Num. decimals to round elev, in ft (numDecimals)    =", numDecimals))
+    arcpy.AddMessage("%s %f" % ("   Z-Factor                           (zFact)          =", zFact))
+    arcpy.AddMessage("%s %s" % ("   Reference Plane                    (refPlane)       =", refPlane))
+    arcpy.AddMessage("%s %s" % ("   Stage-volume engine                (engine)         =", engine))
+    arcpy.AddMessage("%s %i" % ("   Parallel worker processes          (workers)        =", workers))
+    arcpy.AddMessage("%s %s" % ("   Resume from journal                (resume)         =", resume))
+    arcpy.AddMessage("%s %.1f" % ("   DEM tile memory budget, in MB      (tile_mb)        =", tile_mb))
+    arcpy.AddMessage("%s %s" % ("   Zonal mode valley-wide DEM         (inZonalDEM)     =", inZonalDEM))
+    arcpy.AddMessage("%s %s" % ("   Zonal mode parcel label raster     (inParcelRaster) =", inParcelRaster))
+    arcpy.AddMessage("%s %s" % ("   Also write binary store (.bin)     (binary_store)   =", binary_store))
+    arcpy.AddMessage("%s %f" % ("   ADAPTIVE engine tolerance          (tolerance)      =", tolerance))
+    arcpy.AddMessage("%s %s" % ("   Result cache folder                (cache_folder)   =", cache_folder))
+    arcpy.AddMessage("%s %.1f" % ("   Result cache size limit, in MB     (cache_mb)       =", cache_mb))
+    arcpy.AddMessage("%s %s" % ("   Second output datum                (outDatum2)      =", outDatum2))
+    arcpy.AddMessage("%s %s" % ("   Datum offset, in ft, or file       (datum_offset)   =", datum_offset))
+    arcpy.AddMessage("%s %s" % ("   Compress output file (.gz)         (compress)       =", compress))
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+
+    arcpy.AddMessage("%s %s" % ("   Full path and filename of input list of DEMs (inDEM_list_fullpath) =", inDEM_list_fullpath))
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    # Zonal mode reads one valley-wide DEM and a parcel label raster instead of the input list of DEMs.
+    zonal = inZonalDEM != "" or inParcelRaster != ""
+    if zonal:
+        stagelookup_zonal.check_parameters(inZonalDEM, inParcelRaster, engine, workers, cache_folder)
+        inDEM_list_fullpath = "%s zoned by %s" % (inZonalDEM, inParcelRaster)
+        parcels             = []            # Parcel numbers are read from the parcel label raster.
+    else:
+        parcels             = read_dem_list(inDEM_list_fullpath, inDEMpath)
+
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    for outFile_datum in outFiles:
+        arcpy.AddMessage("%s %s" % ("Output file location:", outFile_datum))   # Print output file location to screen.
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+
+    # Reference plane elevations (in feet) for every parcel, rounded to user-specified number of decimals
+    #    to prevent deviations due to floating point values.
+    stages_feet = stagelookup_engine.stage_list(startElev_feet, endElev_feet, incElev_feet, numDecimals)
+
+    # The second datum uses the same stages shifted by the datum offset and is computed in the same pass (see stagelookup_datum.py).
+    datums = None
+    if outDatum2 != "":
+        datums = stagelookup_datum.DatumGrids([0.0, stagelookup_datum.read_offsets(datum_offset)], numDecimals)
+
+    # Open listing file and write output file header info with column names.
+    #    The run journal checkpoints every parcel; in resume mode the file is reopened where an interrupted run
+    #    with the same parameters left off instead of being overwritten.
+    journal = stagelookup_journal.RunJournal(outFile, stagelookup_journal.run_key(inDEM_list_fullpath, parcels, stages_feet, refPlane, zFact, engine, tolerance, outDatum2, datum_offset), resume, outFiles[1:])
+    output  = journal.open_output(stagelookup_engine.header_line(inDEM_list_fullpath), compress)
+    if journal.resumed:
+        arcpy.AddMessage("%s %s" % ("Resuming interrupted run from journal:", journal.path))
+
+    # Write the indexed binary store StageLookup<datum>.bin next to the text file (see stagelookup_store.py) as the
+    #    parcels are written, with the values as computed.  A resumed run reads the parcels finished before the
+    #    interruption back from the text file.
+    stores = []
+    if binary_store:
+        for outFile_datum in outFiles:
+            storeFile = outFile_datum[:-3] if compress else outFile_datum   # Without .gz
+            storeFile = os.path.splitext(storeFile)[0] + ".bin"
+            stores.append(stagelookup_store.StageLookupStoreWriter(storeFile, stagelookup_engine.header_line(inDEM_list_fullpath),
+                                                                   numDecimals))
+            if journal.resumed:
+                stores[-1].add_text(outFile_datum)
+    store = None
+    if stores:
+        store = stores if datums is not None else stores[0]
+
+    # Write screen header info with column names (the lines below may be commented out if screen display is not needed).
+    #    Records are written to the screen only when SCREEN_ROWS is set; otherwise progress is reported.
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    if SCREEN_ROWS:
+        arcpy.AddMessage("%s" % ("OUTPUT COLUMNS:"))
+        arcpy.AddMessage("%s, %s, %s, %s, %s, %s" % ("parcel_number","refElev_feet","not_used","not_used", "Volume_acre-feet","2D_Area_acres")) #RYAN switch 4th & 5th column
+        #arcpy.AddMessage("%s, %s, %s, %s, %s, %s" % ("parcel_number","refElev_feet","not_used","Volume_acre-feet","not_used","2D_Area_acres"))
+
+    # Iterate through all the DEMs in inDEMList, one after another or spread across "workers" processes.
+    #    Parallel runs merge the parcels in input-list order, so the output file is the same as a serial run.
+    #    Zonal mode computes every parcel from one tiled read of the DEM and the parcel label raster.
+    #    Every parcel is timed, and progress, throughput and the estimated time to finish are reported (see stagelookup_metrics.py).
+    metrics = stagelookup_metrics.RunMetrics(len(stages_feet))
+    if zonal:
+        parcels = stagelookup_zonal.run_zonal(output, inZonalDEM, inParcelRaster, stages_feet, refPlane, zFact, journal, tile_mb, datums,
+                                              metrics, store)
+    else:
+        # Parcels and stages already in the result cache are not computed again (see stagelookup_cache.py).
+        cache = None
+        if cache_folder != "":
+            cache = stagelookup_cache.ResultCache(cache_folder, cache_mb)
+        run_stage_lookup(parcels, output, stages_feet, refPlane, zFact, engine, workers, out_folder_path, journal, tile_mb,
+                         tolerance, cache, datums, metrics, store)
+        if engine.upper() == "ADAPTIVE":
+            stagelookup_adaptive.report_summary()
+        if cache is not None:
+            cache.evict()
+            cache.report_summary()
+
+    # Write the run metrics to the screen and to StageLookup<datum>.txt.metrics.json next to the output file.
+    metricsFile = outFile + ".metrics.json"
+    metrics.report_summary()
+    metrics.write(metricsFile)
+
+    # Close files.
+    if datums is None:
+        output.close()
+    else:
+        for f in output:
+            f.close()
+    for datum_store in stores:
+        datum_store.close()
+        arcpy.AddMessage("%s %s" % ("Binary store location =", datum_store.path))
+
+    # Report the parcels that failed (also listed in the .failed.csv file next to the output file).
+    report_failed(journal.finish(parcels))
+
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    stoptime = time.clock() 
+    arcpy.AddMessage("%s %s" % ("DONE:  ", time.strftime("%I:%M:%S", time.localtime())))
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    for outFile_datum in outFiles:
+        arcpy.AddMessage("%s %s" % ("Output file location  =", outFile_datum))
+    arcpy.AddMessage("%s %s" % ("Metrics file location =", metricsFile))
+    arcpy.AddMessage("%s" % (""))  #space out screen messages
+    arcpy.AddMessage("%s %.1f" % ("Elapsed time in minutes: ", ((stoptime-starttime)/60)))
+    return outFiles
@@ -0,0 +1,203 @@
+######################################################################################################################################
+# $Id: stagelookup_store.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Indexed binary StageLookup store with direct (parcel, stage) lookup and export to the text format.
+#
+#           StageLookupNAVD88.txt holds 139k+ formatted records (repeated "not_used" columns, CRLF) that every consumer
+#           has to parse.  The binary store (StageLookup<datum>.bin) holds the same data as little-endian float64
+#           columns, one volume and one area array per parcel, and is read through numpy.memmap:
+#
+#              preamble   magic "STGLKUP1", version, number of parcels, offsets of the parcel index and header text
+#              data       for each parcel: Volume_acft[nstages] followed by 2D_Area_ac[nstages]
+#              index      for each parcel: parc_number, numDecimals, nstages, start elevation, increment, data offset
+#              header     the header line of the text file, so the text export is unchanged
+#
+#           A lookup of (parcel, stage) is a dictionary lookup of the parcel followed by the offset computation
+#           index = round((stage - start) / increment); no records are scanned.  export_text() writes the original
+#           text format, so the downstream Shoreline Management Tool keeps working.
+#
+#           A run with binary_store writes the store as it goes: the BlockWriter (stagelookup_writer.py) hands every
+#           parcel to StageLookupStoreWriter.add_block, so the store holds the float64 values as computed rather than
+#           the 6-decimal values of the text file.  convert_text() builds a store from an existing text file.
+#
+######################################################################################################################################
+
+import struct, gzip
+import numpy
+import stagelookup_engine
+
+MAGIC    = "STGLKUP1"
+VERSION  = 1
+PREAMBLE = struct.Struct("<8sIIQQQ")      # magic, version, nparcels, index offset, header offset, header length
+
+INDEX_DTYPE = numpy.dtype([("parc_number", "<i4"), ("numDecimals", "<i4"), ("nstages", "<i8"),
+                           ("start_feet", "<f8"), ("inc_feet", "<f8"), ("offset", "<i8")])
+
+
+class StageLookupStoreWriter(object):
+    """Write a binary store one parcel at a time.
+
+    numDecimals is the rounding of the stage values; None finds it from the
+    stages of each parcel (decimals_of)."""
+
+    def __init__(self, path, header, numDecimals=None):
+        self.path   = path
+        self.header = header
+        self.numDecimals = numDecimals
+        self.index  = []
+        self.f      = open(path, "wb")
+        self.f.write(PREAMBLE.pack(MAGIC, VERSION, 0, 0, 0, 0))   # Filled in by close().
+
+    def add_parcel(self, parc_number, stages_feet, vol3d_acft, area2d_ac, numDecimals):
+        """Append the table of one parcel.  The stages must be evenly spaced."""
+        nstages = len(stages_feet)
+        inc_feet = 0.0
+        if nstages > 1:
+            inc_feet = round(stages_feet[1] - stages_feet[0], numDecimals)
+            expected = numpy.round(stages_feet[0] + numpy.arange(nstages) * inc_feet, numDecimals)
+            if numpy.abs(expected - numpy.asarray(stages_feet)).max() > 0.5 * 10.0 ** -numDecimals:
+                raise ValueError("Stages of parcel %i are not evenly spaced" % parc_number)
+
+        self.index.append((parc_number, numDecimals, nstages, stages_feet[0] if nstages else 0.0, inc_feet, self.f.tell()))
+        numpy.asarray(vol3d_acft, dtype="<f8").tofile(self.f)
+        numpy.asarray(area2d_ac, dtype="<f8").tofile(self.f)
+
+    def add_block(self, block):
+        """Append one parcel as queued on the BlockWriter of a run.
+
+        Arrays (parc_number, stages_feet, vol3d_acft, area2d_ac) are stored as
+        computed; formatted records (per-stage checkpoint files of the
+        SURFACEVOLUME engine) are parsed back."""
+        if isinstance(block, tuple):
+            parcels = [block]
+        else:
+            parcels = parse_records(block.splitlines(True))
+        for parc_number, stages_feet, vol3d_acft, area2d_ac in parcels:
+            numDecimals = self.numDecimals if self.numDecimals is not None else decimals_of(stages_feet)
+            self.add_parcel(parc_number, stages_feet, vol3d_acft, area2d_ac, numDecimals)
+
+    def add_text(self, text_path):
+        """Append every parcel of a StageLookup text file, or a compressed one (.gz)."""
+        for parcel in read_text(text_path)[1]:
+            self.add_block(parcel)
+
+    def close(self):
+        index_offset = self.f.tell()
+        numpy.array(self.index, dtype=INDEX_DTYPE).tofile(self.f)
+        header_offset = self.f.tell()
+        self.f.write(self.header)
+        self.f.seek(0)
+        self.f.write(PREAMBLE.pack(MAGIC, VERSION, len(self.index), index_offset, header_offset, len(self.header)))
+        self.f.close()
+
+
+class StageLookupStore(object):
+    """Memory-mapped reader of a binary store."""
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, "rb")
+        magic, version, nparcels, index_offset, header_offset, header_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if magic != MAGIC or version != VERSION:
+            f.close()
+            raise ValueError("%s is not a version %i StageLookup store" % (path, VERSION))
+        f.seek(header_offset)
+        self.header = f.read(header_len)
+        f.close()
+
+        self.index = numpy.memmap(path, dtype=INDEX_DTYPE, mode="r", offset=index_offset, shape=(nparcels,))
+        self.data  = numpy.memmap(path, dtype="<f8", mode="r", shape=(index_offset // 8,))
+        self.parcel_numbers = [int(x) for x in self.index["parc_number"]]
+        self.position = dict([(parc_number, i) for i, parc_number in enumerate(self.parcel_numbers)])
+
+    def _entry(self, parc_number):
+        try:
+            return self.index[self.position[parc_number]]
+        except KeyError:
+            raise KeyError("Parcel %s is not in %s" % (parc_number, self.path))
+
+    def stages(self, parc_number):
+        """Stage values, in feet, of one parcel."""
+        entry = self._entry(parc_number)
+        return numpy.round(entry["start_feet"] + numpy.arange(entry["nstages"]) * entry["inc_feet"], entry["numDecimals"])
+
+    def parcel(self, parc_number):
+        """(stages_feet, vol3d_acft, area2d_ac) of one parcel; the value arrays are memory-mapped views."""
+        entry = self._entry(parc_number)
+        first = entry["offset"] // 8
+        n = entry["nstages"]
+        return self.stages(parc_number), self.data[first:first + n], self.data[first + n:first + 2 * n]
+
+    def lookup(self, parc_number, refElev_feet):
+        """(vol3d_acft, area2d_ac) of one parcel at one tabulated stage."""
+        entry = self._entry(parc_number)
+        n = int(entry["nstages"])
+        i = 0
+        if entry["inc_feet"] > 0:
+            i = int(round((refElev_feet - entry["start_feet"]) / entry["inc_feet"]))
+        if i < 0 or i >= n or abs(entry["start_feet"] + i * entry["inc_feet"] - refElev_feet) > 0.5 * 10.0 ** -entry["numDecimals"]:
+            raise KeyError("Stage %f is not tabulated for parcel %i" % (refElev_feet, parc_number))
+        first = entry["offset"] // 8
+        return self.data[first + i], self.data[first + n + i]
+
+    def export_text(self, path):
+        """Write the store in the StageLookup text format (binary mode, as the run writes it)."""
+        output = open(path, "wb")
+        output.write(self.header)
+        for parc_number in self.parcel_numbers:
+            stages_feet, vol3d_acft, area2d_ac = self.parcel(parc_number)
+            output.write(stagelookup_engine.format_rows(parc_number, stages_feet, vol3d_acft, area2d_ac))
+        output.close()
+
+
+def read_text(path):
+    """Parse a StageLookup text file, or a compressed one (.gz).
+
+    Returns (header, parcels) where parcels is a list of
+    (parc_number, stages_feet, vol3d_acft, area2d_ac) in file order."""
+    if path.lower().endswith(".gz"):
+        f = gzip.open(path, "rb")
+    else:
+        f = open(path, "rb")
+    header = f.readline()
+    parcels = parse_records(f)
+    f.close()
+    return header, parcels
+
+
+def parse_records(lines):
+    """Parse StageLookup records (no header line) into a list of
+    (parc_number, stages_feet, vol3d_acft, area2d_ac), in record order."""
+    parcels = []
+    current = None
+    for line in lines:
+        fields = line.split(",")
+        if len(fields) < 6:
+            continue
+        parc_number = int(fields[0])
+        if current is None or current[0] != parc_number:
+            current = (parc_number, [], [], [])
+            parcels.append(current)
+        current[1].append(float(fields[1]))
+        current[2].append(float(fields[4]))
+        current[3].append(float(fields[5]))
+    return parcels
+
+
+def decimals_of(values, max_decimals=6):
+    """Smallest number of decimals that represents every stage value."""
+    values = numpy.asarray(values)
+    for numDecimals in range(max_decimals + 1):
+        if numpy.abs(numpy.round(values, numDecimals) - values).max() < 1e-9:
+            return numDecimals
+    return max_decimals
+
+
+def convert_text(text_path, store_path, numDecimals=None):
+    """Build a binary store from a StageLookup text file."""
+    header, parcels = read_text(text_path)
+    writer = StageLookupStoreWriter(store_path, header, numDecimals)
+    for parcel in parcels:
+        writer.add_block(parcel)
+    writer.close()
@@ -0,0 +1,160 @@
+######################################################################################################################################
+# $Id: stagelookup_writer.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Buffered output writer that formats and writes whole parcels on a background thread.
+#
+#           The parcel loop used to format and write the records of a parcel, and checkpoint it, before it could start
+#           on the next parcel.  BlockWriter takes a whole parcel at a time, either its arrays
+#              (parc_number, stages_feet, vol3d_acft, area2d_ac)
+#           or records already formatted (per-stage checkpoint files of the SURFACEVOLUME engine), or a list of
+#           these, one per output datum.  A background thread formats each parcel in bulk (stagelookup_engine.format_rows),
+#           appends it to the output file(s) and checkpoints it in the journal, while the main thread computes the next
+#           parcel.  The queue between them holds at most DEFAULT_QUEUE_BLOCKS parcels, so a slow disk or network share
+#           holds the computation back instead of filling memory.  Parcels are written in the order they are queued and
+#           the bytes written are the same as before; arcpy is only called from the main thread.  With binary_store,
+#           the same thread adds every parcel to the binary store (stagelookup_store.py).
+#
+#           With compressed output, the output file (StageLookup<datum>.txt.gz) is written as a series of gzip members,
+#           one for the header and one per parcel.  Every journaled offset is the end of a member, so an interrupted run
+#           can still be resumed, and gzip (or Python's gzip module) reads the members back as one StageLookup file.
+#
+######################################################################################################################################
+
+import sys, os, time, zlib, threading, collections, Queue
+import stagelookup_engine
+
+DEFAULT_QUEUE_BLOCKS = 4     # Parcels queued for the writer thread before the computation waits.
+GZIP_LEVEL           = 6     # zlib compression level of compressed output.
+
+
+def format_block(block):
+    """StageLookup records of one parcel: arrays are formatted, formatted records are returned as is."""
+    if isinstance(block, tuple):
+        return stagelookup_engine.format_rows(*block)
+    return block
+
+
+def write_block(output, block):
+    """Append the records of one parcel to output, or the block of each datum to its file."""
+    if isinstance(output, list):
+        for f, datum_block in zip(output, block):
+            f.write(format_block(datum_block))
+    else:
+        output.write(format_block(block))
+
+
+def store_block(store, block):
+    """Add one parcel to the binary store (stagelookup_store.StageLookupStoreWriter), or the block of each datum to its store."""
+    if isinstance(store, list):
+        for datum_store, datum_block in zip(store, block):
+            datum_store.add_block(datum_block)
+    else:
+        store.add_block(block)
+
+
+class GzipMemberFile(object):
+    """Output file written as gzip members, one per write."""
+
+    def __init__(self, f, level=GZIP_LEVEL):
+        self.f     = f                               # Opened in binary mode.
+        self.level = level
+        self.name  = f.name
+
+    def write(self, data):
+        if not data:
+            return
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)   # gzip header and trailer.
+        self.f.write(compressor.compress(data) + compressor.flush())
+
+    def flush(self):
+        self.f.flush()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def tell(self):
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+
+class BlockWriter(object):
+    """Background thread that appends parcels to the output file(s) and checkpoints them, in queue order.
+
+    With a store (stagelookup_store.StageLookupStoreWriter, or a list of them,
+    one per datum) every parcel is also added to the binary store."""
+
+    def __init__(self, output, journal=None, metrics=None, store=None, queue_blocks=DEFAULT_QUEUE_BLOCKS):
+        self.output  = output
+        self.journal = journal
+        self.metrics = metrics
+        self.store   = store
+        self.queue   = Queue.Queue(max(int(queue_blocks), 1))
+        self.written = collections.deque()       # (parc_numSTR, timing, write seconds, failed) for the metrics.
+        self.error   = None                      # sys.exc_info() of a failed write.
+        self.thread  = threading.Thread(target=self._run, name="StageLookupWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append(self, index, parc_numSTR, inDEM, block, timing=None, remove_files=()):
+        """Queue a finished parcel; waits while the queue is full.
+
+        remove_files (checkpoint or block files of the parcel) are removed once
+        the parcel is checkpointed, so an interrupted run can still use them."""
+        self._put((index, parc_numSTR, inDEM, block, timing, None, remove_files))
+
+    def failed(self, index, parc_numSTR, inDEM, msg, remove_files=()):
+        """Queue the checkpoint of a parcel that could not be computed."""
+        self._put((index, parc_numSTR, inDEM, None, None, msg, remove_files))
+
+    def close(self):
+        """Wait until every queued parcel is written.  Does not close the output file(s)."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._record()
+        self._check()
+
+    def _put(self, item):
+        self._check()
+        self.queue.put(item)
+        self._record()
+
+    def _check(self):
+        """Raise the error of a failed write in the main thread."""
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def _record(self):
+        """Hand the parcels written so far to the metrics (which write to the screen) from the main thread."""
+        while self.written:
+            parc_numSTR, timing, write, failed = self.written.popleft()
+            if self.metrics is not None:
+                self.metrics.parcel_done(parc_numSTR, timing, write, failed)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue                                # Nothing more is written after a failed write.
+            index, parc_numSTR, inDEM, block, timing, msg, remove_files = item
+            try:
+                start = time.time()
+                if msg is None:
+                    write_block(self.output, block)
+                    if self.store is not None:
+                        store_block(self.store, block)
+                    if self.journal is not None:
+                        self.journal.parcel_done(index, parc_numSTR, self.output)
+                elif self.journal is not None:
+                    self.journal.parcel_failed(index, parc_numSTR, inDEM, msg, self.output)
+                for path in remove_files:
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.written.append((parc_numSTR, timing, time.time() - start, msg is not None))
+            except Exception:
+                self.error = sys.exc_info()
@@ -0,0 +1,148 @@
+######################################################################################################################################
+# $Id: stagelookup_zonal.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Zonal mode: the StageLookup tables of every parcel from one valley-wide DEM and a parcel label raster.
+#
+#           Instead of pre-clipping one DEM per parcel and listing them in the input list of DEMs, the user supplies
+#           one DEM and a co-registered raster (same extent and cell size) whose cell values are the PARC_NUMBER of the
+#           parcel each cell belongs to.  Both rasters are read once, tile by tile, and the cumulative stage histogram
+#           of stagelookup_engine.StageAccumulator is accumulated per label, so neither the clipping step nor the
+#           repeated reads of the overlapping mosaic are needed.
+#
+#           Cells that are NoData in either raster are ignored.  Parcels are written in order of increasing parcel
+#           number, each sorted by increasing stage, in the usual StageLookup layout.  A second vertical datum
+#           (stagelookup_datum.py) is supported with a constant datum offset.  Zonal mode always uses the NUMPY engine,
+#           serially and without the result cache; other engine, workers and cache_folder settings are reported as
+#           warnings and ignored.
+#
+######################################################################################################################################
+
+import time
+import numpy
+import arcpy
+import stagelookup_engine, stagelookup_run, stagelookup_writer
+
+
+class ZonalStageAccumulator(object):
+    """One cumulative stage histogram per parcel label, filled from shared tiles."""
+
+    def __init__(self, stages_feet, refPlane, zFact, cell_area):
+        self.stages_feet = stages_feet
+        self.refPlane    = refPlane
+        self.zFact       = zFact
+        self.cell_area   = cell_area
+        self.template    = stagelookup_engine.StageAccumulator(stages_feet, refPlane, zFact, cell_area)
+        self.parcels     = {}                                 # PARC_NUMBER -> StageAccumulator
+
+    def add(self, z, labels):
+        """Add a tile of elevations (meters) and the matching parcel labels.  NaN marks NoData in either."""
+        z      = numpy.asarray(z, dtype=numpy.float64).ravel()
+        labels = numpy.asarray(labels, dtype=numpy.float64).ravel()
+        valid  = ~(numpy.isnan(z) | numpy.isnan(labels))
+        if not valid.any():
+            return
+        z      = z[valid]
+        labels = labels[valid].astype(numpy.int64)
+
+        # Grouped accumulation: one bincount over (label, stage bin) pairs for the whole tile.
+        bins, weights = self.template.bin_elevations(z)
+        parcel_numbers, group = numpy.unique(labels, return_inverse=True)
+        nbins = len(self.template.counts)
+        key   = group * nbins + bins
+        size  = len(parcel_numbers) * nbins
+        counts = numpy.bincount(key, minlength=size).reshape(len(parcel_numbers), nbins)
+        sums   = numpy.bincount(key, weights=weights, minlength=size).reshape(len(parcel_numbers), nbins)
+
+        for i, parc_number in enumerate(parcel_numbers):
+            acc = self.parcels.get(parc_number)
+            if acc is None:
+                acc = stagelookup_engine.StageAccumulator(self.stages_feet, self.refPlane, self.zFact, self.cell_area)
+                self.parcels[parc_number] = acc
+            acc.counts += counts[i]
+            acc.sums   += sums[i]
+
+    def results(self):
+        """Yield (parc_number, vol3d_acft, area2d_ac) in order of increasing parcel number."""
+        for parc_number in sorted(self.parcels):
+            vol3d_acft, area2d_ac = self.parcels[parc_number].result()
+            yield parc_number, vol3d_acft, area2d_ac
+
+
+def check_parameters(inZonalDEM, inParcelRaster, engine="NUMPY", workers=1, cache_folder=""):
+    """Raise ValueError unless both zonal mode rasters are given; warn about settings zonal mode does not use."""
+    if inZonalDEM == "" or inParcelRaster == "":
+        raise ValueError("Zonal mode needs both the valley-wide DEM (inZonalDEM) and the parcel number raster (inParcelRaster)")
+    ignored = []
+    if (engine or "NUMPY").upper() != "NUMPY":
+        ignored.append("engine %s: parcels are computed with the NUMPY engine" % engine)
+    if workers > 1:
+        ignored.append("workers %i: parcels are computed in one serial read of both rasters" % workers)
+    if cache_folder != "":
+        ignored.append("cache_folder %s: the result cache is not used" % cache_folder)
+    for setting in ignored:
+        arcpy.AddWarning("%s %s" % ("Zonal mode ignores", setting))
+
+
+def check_coregistered(dem, labels):
+    """Raise ValueError unless the DEM and the parcel label raster share extent and cell size."""
+    if (dem.width, dem.height) != (labels.width, labels.height) or \
+       abs(dem.meanCellWidth - labels.meanCellWidth) > 1e-6 * dem.meanCellWidth or \
+       abs(dem.meanCellHeight - labels.meanCellHeight) > 1e-6 * dem.meanCellHeight or \
+       abs(dem.extent.XMin - labels.extent.XMin) > 0.5 * dem.meanCellWidth or \
+       abs(dem.extent.YMax - labels.extent.YMax) > 0.5 * dem.meanCellHeight:
+        raise ValueError("The DEM and the parcel raster must be co-registered (same extent, rows, columns and cell size)")
+
+
+def zonal_volume_tables(inDEM, inParcelRaster, stages_feet, refPlane, zFact, tile_mb=stagelookup_engine.DEFAULT_TILE_MB):
+    """Yield (parc_number, vol3d_acft, area2d_ac) for every parcel label, from one tiled read of both rasters."""
+    dem    = arcpy.Raster(inDEM)
+    labels = arcpy.Raster(inParcelRaster)
+    check_coregistered(dem, labels)
+
+    # Both rasters hold one value per cell, so a tile of the pair needs twice the memory of a DEM tile.
+    tile_mb = float(tile_mb or stagelookup_engine.DEFAULT_TILE_MB) / 2
+    acc = ZonalStageAccumulator(stages_feet, refPlane, zFact, dem.meanCellWidth * dem.meanCellHeight)
+    for z, parcel_tile in zip(stagelookup_engine.dem_tiles(dem, tile_mb), stagelookup_engine.dem_tiles(labels, tile_mb)):
+        acc.add(z, parcel_tile)
+    return acc.results()
+
+
+def run_zonal(output, inDEM, inParcelRaster, stages_feet, refPlane, zFact, journal=None,
+              tile_mb=stagelookup_engine.DEFAULT_TILE_MB, datums=None, metrics=None, store=None):
+    """Write the StageLookup records of every parcel in the parcel raster to output.
+
+    With datums (constant offsets only) output is the list of output files,
+    one per datum.  With metrics (stagelookup_metrics.RunMetrics) every parcel
+    is timed; the shared read of the rasters is counted with the first one.
+    With a store (stagelookup_store.StageLookupStoreWriter, a list with
+    datums) every parcel is also added to the binary store.
+    Returns the list of (parc_numSTR, inDEM) written, in output order."""
+    planes_feet = stages_feet
+    if datums is not None:
+        if not datums.constant:
+            raise ValueError("Zonal mode needs a constant datum offset, not a per-parcel list of offsets")
+        planes_feet, grids = datums.grids(stages_feet)
+
+    parcels = []
+    start = time.time()
+    writer = stagelookup_writer.BlockWriter(output, journal, metrics, store)
+    try:
+        for index, (parc_number, vol3d_acft, area2d_ac) in enumerate(
+                zonal_volume_tables(inDEM, inParcelRaster, planes_feet, refPlane, zFact, tile_mb)):
+            parc_numSTR = str(parc_number)
+            parcels.append((parc_numSTR, inDEM))
+            if journal is not None and index in journal.done:
+                continue                                      # Written before an interruption.
+            if datums is not None:
+                block = datums.tables(parc_number, grids, vol3d_acft, area2d_ac)
+            else:
+                block = (parc_number, stages_feet, vol3d_acft, area2d_ac)
+            compute = time.time() - start
+            stagelookup_run.queue_block(writer, index, parc_numSTR, inDEM, block, (compute, 0, compute, 0.0, 0.0, 0))
+            start = time.time()
+    finally:
+        writer.close()
+    if metrics is not None:
+        metrics.progress()                                    # The number of parcels was not known in advance.
+    return parcels
@@ -0,0 +1,431 @@
+######################################################################################################################################
+# $Id: test_stagelookup.py
+#
+# Project:  Create_Stagelookup_Data_Table
+# Purpose:  Automated tests of the StageLookup generation, run on synthetic DEMs with the local arcpy stand-in.
+#
+#           arcpy_standin.py is installed as arcpy, as in stagelookup_benchmark.py, so the tests run on any machine with
+#           Python 2.7 and NumPy.  They cover the guarantees the run makes:
+#              - an interrupted run resumed from its journal gives the same bytes as an uninterrupted run;
+#              - a parallel run gives the same bytes as a serial run;
+#              - the NUMPY and SURFACEVOLUME engines agree;
+#              - a DEM read in small tiles gives the same tables as one whole read;
+#              - ADAPTIVE stays within its tolerance, also with missing or out-of-date DEM statistics;
+#              - zonal mode gives the same tables as the input list of DEMs;
+#              - the binary store gives back the StageLookup text file, and holds the values as computed;
+#              - a run that widens the stage range of a cached run gives the same bytes as an uncached run, a changed
+#                DEM is not taken from the cache, and eviction keeps the cache within its size limit;
+#              - batch queries of 0.1 ft tables at 0.01 ft stay close to 0.01 ft tables, and invert;
+#              - the second datum holds the values of the shifted reference planes;
+#              - the metrics file counts the parcels and the stages computed, not those taken from the cache;
+#              - compressed output decompresses to the plain StageLookup file, also after a resumed run;
+#
+#           Usage (from the ShorelineTools folder):
+#              python -m unittest discover -s tests
+#
+######################################################################################################################################
+
+import sys, os, gzip, json, shutil, tempfile, unittest
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import arcpy_standin
+sys.modules["arcpy"] = arcpy_standin          # Before any stage-lookup module imports arcpy.
+
+import stagelookup_engine, stagelookup_run, stagelookup_adaptive, stagelookup_store, stagelookup_query, stagelookup_cache, \
+       stagelookup_benchmark
+
+START_FEET = 4135.30
+END_FEET   = 4176.30
+INC_FEET   = 0.10
+PARCELS    = 4
+SIZE_M     = 60.0                 # Parcel width and height, in meters.
+QUERY_VOL  = 5e-5                 # Acre-feet: 0.1 ft tables queried at 0.01 ft against 0.01 ft tables.
+QUERY_AREA = 2.5e-3               # Acres, likewise.
+
+
+def _read(path):
+    if path.endswith(".gz"):
+        f = gzip.open(path, "rb")
+    else:
+        f = open(path, "rb")
+    data = f.read()
+    f.close()
+    return data
+
+
+def _records(path):
+    """StageLookup records without the header line, which names the input list of DEMs."""
+    return _read(path).split("\r\n", 1)[1]
+
+
+class _Interrupt(KeyboardInterrupt):
+    """Stops a run the way a killed process would: not caught by the per-parcel error handling."""
+
+
+class StageLookupTestCase(unittest.TestCase):
+    """Synthetic parcel DEMs and a valley-wide DEM with its parcel label raster, in a temporary folder."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp(prefix="StageLookupTest_")
+        cls.dems = []
+        list_file = open(os.path.join(cls.folder, "dem_list.csv"), "w")
+        for parc_number in range(1, PARCELS + 1):
+            name = "parcel_%03i.npy" % parc_number
+            stagelookup_benchmark.make_dem(os.path.join(cls.folder, name), SIZE_M, 1.0, parc_number)
+            cls.dems.append(os.path.join(cls.folder, name))
+            list_file.write("%i,%s\n" % (parc_number, name))
+        list_file.close()
+        cls.list_file = list_file.name
+        cls.stages = stagelookup_engine.stage_list(START_FEET, END_FEET, INC_FEET, 2)
+
+        # Valley-wide DEM of four quadrants, each labeled with its parcel number, and one DEM per parcel with the
+        #    cells of the other parcels set to NoData, for the input list of DEMs.
+        n = int(2 * SIZE_M)
+        coords = numpy.arange(n) + 0.5 - SIZE_M
+        x, y = numpy.meshgrid(coords, -coords)
+        z = stagelookup_benchmark.terrain(x, y, 7).astype(numpy.float32)
+        labels = numpy.where(y > 0, 1, 3) + numpy.where(x > 0, 1, 0)
+        labels[:, :3] = -9999                      # NoData labels and DEM cells along the edges.
+        z[-2:, :] = -9999.0
+        arcpy_standin.save_raster(os.path.join(cls.folder, "valley.npy"), z, 1.0)
+        arcpy_standin.save_raster(os.path.join(cls.folder, "labels.npy"), labels.astype(numpy.int32), 1.0)
+        zoned_list = open(os.path.join(cls.folder, "zoned_list.csv"), "w")
+        for parc_number in range(1, 5):
+            name = "zoned_%03i.npy" % parc_number
+            arcpy_standin.save_raster(os.path.join(cls.folder, name), numpy.where(labels == parc_number, z, -9999.0), 1.0)
+            zoned_list.write("%i,%s\n" % (parc_number, name))
+        zoned_list.close()
+        cls.zoned_list = zoned_list.name
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder, ignore_errors=True)
+
+    def setUp(self):
+        self.out = tempfile.mkdtemp(prefix="out_", dir=self.folder)
+        stagelookup_adaptive.STATS.take()
+
+    def tearDown(self):
+        shutil.rmtree(self.out, ignore_errors=True)
+
+    def run_tool(self, out=None, list_file=None, **parameters):
+        """create_stage_lookup with the test parameters; returns the output files."""
+        if list_file is None:
+            list_file = self.list_file
+        arguments = dict(inDEM_list_fullpath=list_file, inDEMpath=self.folder, inDEMdatum="NAVD88", out_folder_path=out or self.out,
+                         startElev_feet=START_FEET, endElev_feet=END_FEET, incElev_feet=INC_FEET, numDecimals=2, zFact=1.0, refPlane="BELOW")
+        arguments.update(parameters)
+        return stagelookup_run.create_stage_lookup(**arguments)
+
+    def interrupted_run(self, **parameters):
+        """run_tool, stopped in the third parcel after the first two were journaled."""
+        volume_table = stagelookup_engine.volume_table
+        calls = [0]
+        def interrupted(*args):
+            calls[0] += 1
+            if calls[0] == 3:
+                raise _Interrupt()
+            return volume_table(*args)
+        stagelookup_engine.volume_table = interrupted
+        try:
+            self.assertRaises(_Interrupt, self.run_tool, **parameters)
+        finally:
+            stagelookup_engine.volume_table = volume_table
+
+
+class RunTest(StageLookupTestCase):
+
+    def test_resume_after_crash_is_byte_identical(self):
+        expected = _read(self.run_tool(out=tempfile.mkdtemp(dir=self.out))[0])
+
+        # Interrupt the run in the third parcel and leave half a parcel of records behind it in the output file, as
+        #    a killed process would.
+        self.interrupted_run()
+        outFile = os.path.join(self.out, "StageLookupNAVD88.txt")
+        self.assertTrue(len(_read(outFile)) < len(expected))
+        f = open(outFile, "ab")
+        f.write(expected[len(expected) // 2:len(expected) // 2 + 1000])
+        f.close()
+
+        self.run_tool(resume=True)
+        self.assertEqual(_read(outFile), expected)
+
+    def test_parallel_is_byte_identical_to_serial(self):
+        for engine in ["NUMPY", "SURFACEVOLUME"]:
+            serial   = self.run_tool(out=tempfile.mkdtemp(dir=self.out), engine=engine, workers=1)[0]
+            parallel = self.run_tool(out=tempfile.mkdtemp(dir=self.out), engine=engine, workers=2)[0]
+            self.assertEqual(_read(parallel), _read(serial), engine)
+
+    def test_compressed_output_decompresses_to_plain_output(self):
+        plain      = self.run_tool(out=tempfile.mkdtemp(dir=self.out))[0]
+        compressed = self.run_tool(out=tempfile.mkdtemp(dir=self.out), compress=True)[0]
+        self.assertTrue(compressed.endswith(".txt.gz"))
+        self.assertEqual(_read(compressed), _read(plain))
+
+    def test_compressed_output_resumes(self):
+        expected = _read(self.run_tool(out=tempfile.mkdtemp(dir=self.out))[0])
+        self.interrupted_run(compress=True)
+        outFile = self.run_tool(compress=True, resume=True)[0]
+        self.assertEqual(_read(outFile), expected)
+
+    def test_store_round_trip(self):
+        for workers in [1, 2]:
+            out = tempfile.mkdtemp(dir=self.out)
+            outFile = self.run_tool(out=out, workers=workers, binary_store=True)[0]
+            exported = os.path.join(out, "exported.txt")
+            stagelookup_store.StageLookupStore(os.path.splitext(outFile)[0] + ".bin").export_text(exported)
+            self.assertEqual(_read(exported), _read(outFile), workers)
+
+    def test_store_holds_computed_values(self):
+        for workers in [1, 2]:
+            outFile = self.run_tool(out=tempfile.mkdtemp(dir=self.out), workers=workers, binary_store=True)[0]
+            store = stagelookup_store.StageLookupStore(os.path.splitext(outFile)[0] + ".bin")
+            self.assertEqual(store.parcel_numbers, range(1, PARCELS + 1))
+            for parc_number, inDEM in zip(store.parcel_numbers, self.dems):
+                stages, vol, area = store.parcel(parc_number)
+                self.assertEqual(list(stages), self.stages)
+                expected_vol, expected_area = stagelookup_engine.volume_table(inDEM, self.stages, "BELOW", 1.0)
+                numpy.testing.assert_allclose(vol, expected_vol, rtol=1e-12, atol=0)     # Not rounded to the text decimals.
+                numpy.testing.assert_allclose(area, expected_area, rtol=1e-12, atol=0)
+
+    def test_zonal_matches_list(self):
+        listed = self.run_tool(out=tempfile.mkdtemp(dir=self.out), list_file=self.zoned_list)[0]
+        zonal  = self.run_tool(out=tempfile.mkdtemp(dir=self.out), list_file="",
+                               inZonalDEM=os.path.join(self.folder, "valley.npy"),
+                               inParcelRaster=os.path.join(self.folder, "labels.npy"))[0]
+        listed_parcels = stagelookup_store.read_text(listed)[1]
+        zonal_parcels  = stagelookup_store.read_text(zonal)[1]
+        self.assertEqual([p[0] for p in zonal_parcels], [p[0] for p in listed_parcels])
+        for (parc_number, stages, vol, area), (_, zonal_stages, zonal_vol, zonal_area) in zip(listed_parcels, zonal_parcels):
+            self.assertEqual(zonal_stages, stages)
+            numpy.testing.assert_allclose(zonal_vol, vol, rtol=0, atol=2e-6)
+            numpy.testing.assert_allclose(zonal_area, area, rtol=0, atol=2e-6)
+
+    def test_zonal_needs_both_rasters(self):
+        self.assertRaises(ValueError, self.run_tool, list_file="", inParcelRaster=os.path.join(self.folder, "labels.npy"))
+
+    def test_second_datum_is_shifted(self):
+        offset = -2.47                                 # Not a multiple of the increment: extra planes are computed.
+        outFiles = self.run_tool(outDatum2="NGVD29", datum_offset=str(offset))
+        self.assertEqual(_records(outFiles[0]), _records(self.run_tool(out=tempfile.mkdtemp(dir=self.out))[0]))
+
+        parcels = stagelookup_store.read_text(outFiles[1])[1]
+        self.assertEqual(len(parcels), PARCELS)
+        for (parc_number, labels, vol, area), inDEM in zip(parcels, self.dems):
+            self.assertEqual(labels, [round(stage + offset, 2) for stage in self.stages])
+            planes = [round(label - offset, 2) for label in labels]
+            expected_vol, expected_area = stagelookup_engine.volume_table(inDEM, planes, "BELOW", 1.0)
+            numpy.testing.assert_allclose(vol, expected_vol, rtol=0, atol=1e-6)
+            numpy.testing.assert_allclose(area, expected_area, rtol=0, atol=1e-6)
+
+    def test_blank_datum_offset_is_an_error(self):
+        self.assertRaises(ValueError, self.run_tool, outDatum2="NGVD29", datum_offset="")
+
+    def test_metrics_file(self):
+        list_file = os.path.join(self.out, "dem_list_missing.csv")
+        f = open(list_file, "w")
+        f.write(open(self.list_file, "r").read() + "%i,%s\n" % (PARCELS + 1, "missing.npy"))
+        f.close()
+        outFile = self.run_tool(list_file=list_file)[0]
+        f = open(outFile + ".metrics.json", "r")
+        metrics = json.load(f)
+        f.close()
+
+        totals = metrics["totals"]
+        n = len(self.stages)
+        self.assertEqual((totals["parcels"], totals["failed"]), (PARCELS + 1, 1))
+        self.assertEqual(totals["stages_per_parcel"], n)
+        self.assertEqual((totals["stage_evaluations"], totals["stages_reused"]), (PARCELS * n, 0))
+        self.assertEqual(totals["backend_calls"], 0)                # NUMPY engine.
+        self.assertTrue(totals["evaluations_per_s"] > 0)
+        self.assertEqual([record["parc_number"] for record in metrics["parcels"]],
+                         [str(parc_number) for parc_number in range(1, PARCELS + 2)])
+        self.assertEqual([record["failed"] for record in metrics["parcels"]], [False] * PARCELS + [True])
+        self.assertEqual([record["stages"] for record in metrics["parcels"]], [n] * PARCELS + [0])
+        for record in metrics["parcels"]:
+            for name in ["wall_s", "compute_s", "parse_s", "write_s"]:
+                self.assertTrue(record[name] >= 0, name)
+        self.assertAlmostEqual(totals["wall_s"], sum([record["wall_s"] for record in metrics["parcels"]]))
+
+    def test_cache_hits_are_not_stage_evaluations(self):
+        cache_folder = os.path.join(self.out, "cache")
+        n = len(self.stages)
+        self.run_tool(out=tempfile.mkdtemp(dir=self.out), cache_folder=cache_folder, startElev_feet=4150.00)
+        for workers in [1, 2]:
+            outFile = self.run_tool(out=tempfile.mkdtemp(dir=self.out), cache_folder=cache_folder, workers=workers)[0]
+            f = open(outFile + ".metrics.json", "r")
+            totals = json.load(f)["totals"]
+            f.close()
+            computed = PARCELS * len([stage for stage in self.stages if stage < 4150.00])
+            self.assertEqual(totals["stage_evaluations"], computed if workers == 1 else 0, workers)
+            self.assertEqual(totals["stages_reused"], PARCELS * n - totals["stage_evaluations"], workers)
+
+
+class CacheTest(StageLookupTestCase):
+
+    def test_widened_range_is_byte_identical_to_uncached_run(self):
+        cache_folder = os.path.join(self.out, "cache")
+        for engine in ["NUMPY", "SURFACEVOLUME"]:
+            expected = _read(self.run_tool(out=tempfile.mkdtemp(dir=self.out), engine=engine)[0])
+            self.run_tool(out=tempfile.mkdtemp(dir=self.out), engine=engine, cache_folder=cache_folder,
+                          startElev_feet=4150.00, endElev_feet=4160.00)
+            widened = self.run_tool(out=tempfile.mkdtemp(dir=self.out), engine=engine, cache_folder=cache_folder)[0]
+            self.assertEqual(_read(widened), expected, engine)
+
+    def test_changed_dem_is_a_miss(self):
+        inDEM = os.path.join(self.out, "resurveyed.npy")
+        z = numpy.load(self.dems[0])
+        arcpy_standin.save_raster(inDEM, z, 1.0)
+        cache = stagelookup_cache.ResultCache(os.path.join(self.out, "cache"))
+        cache.volume_table(inDEM, self.stages, "BELOW", 1.0)
+        cache.volume_table(inDEM, self.stages, "BELOW", 1.0)
+        self.assertEqual(cache.take(), (1, 0, 1, len(self.stages), len(self.stages)))
+
+        z[10:20, 10:20] -= 0.5                             # Re-surveyed: a pit dug in the parcel.
+        arcpy_standin.save_raster(inDEM, z, 1.0)
+        vol, area = cache.volume_table(inDEM, self.stages, "BELOW", 1.0)
+        self.assertEqual(cache.take(), (0, 0, 1, 0, len(self.stages)))
+        expected_vol, expected_area = stagelookup_engine.volume_table(inDEM, self.stages, "BELOW", 1.0)
+        numpy.testing.assert_array_equal(vol, expected_vol)
+        numpy.testing.assert_array_equal(area, expected_area)
+
+    def test_evict_keeps_cache_within_limit(self):
+        cache = stagelookup_cache.ResultCache(os.path.join(self.out, "cache"))
+        for inDEM in self.dems:
+            for refPlane in ["BELOW", "ABOVE"]:
+                cache.volume_table(inDEM, self.stages, refPlane, 1.0)
+        entries = cache.entries()
+        self.assertEqual(len(entries), 2 * PARCELS)
+        cache.max_mb = 2.5 * max([entry[1] for entry in entries]) / (1024 * 1024)
+        cache.evict()
+        self.assertTrue(sum([entry[1] for entry in cache.entries()]) <= cache.max_mb * 1024 * 1024)
+        self.assertEqual(cache.evicted, 2 * PARCELS - len(cache.entries()))
+        self.assertTrue(cache.evicted > 0)
+
+
+class EngineTest(StageLookupTestCase):
+
+    def test_numpy_and_surfacevolume_agree(self):
+        for refPlane in ["BELOW", "ABOVE"]:
+            for inDEM in self.dems:
+                vol, area = stagelookup_engine.volume_table(inDEM, self.stages, refPlane, 1.0, "NUMPY")
+                sv_vol, sv_area = stagelookup_engine.volume_table(inDEM, self.stages, refPlane, 1.0, "SURFACEVOLUME")
+                numpy.testing.assert_allclose(sv_vol, vol, rtol=1e-9, atol=1e-9)
+                numpy.testing.assert_allclose(sv_area, area, rtol=1e-9, atol=1e-9)
+
+    def test_tiled_read_matches_whole_read(self):
+        inDEM = self.dems[0]
+        nrows, ncols = numpy.load(inDEM).shape
+        whole_mb = 2.0 * nrows * ncols * stagelookup_engine.BYTES_PER_CELL / (1024 * 1024)
+        self.assertEqual(stagelookup_engine.tile_shape(nrows, ncols, whole_mb), (nrows, ncols))
+        for refPlane in ["BELOW", "ABOVE"]:
+            vol, area = stagelookup_engine.volume_table(inDEM, self.stages, refPlane, 1.0, "NUMPY", tile_mb=whole_mb)
+            for cells in [16, ncols + 5, 7 * ncols + 3]:     # Partial rows, single rows, strips with a shorter last one.
+                tile_mb = (cells + 0.5) * stagelookup_engine.BYTES_PER_CELL / (1024 * 1024)
+                tiled_vol, tiled_area = stagelookup_engine.volume_table(inDEM, self.stages, refPlane, 1.0, "NUMPY",
+                                                                        tile_mb=tile_mb)
+                numpy.testing.assert_allclose(tiled_vol, vol, rtol=1e-12, atol=1e-9)
+                numpy.testing.assert_allclose(tiled_area, area, rtol=1e-12, atol=1e-9)
+
+    def test_adaptive_within_tolerance(self):
+        stages = stagelookup_engine.stage_list(START_FEET, END_FEET, 0.01, 2)
+        for refPlane in ["BELOW", "ABOVE"]:
+            for inDEM in self.dems[:2]:
+                vol, area = stagelookup_engine.volume_table(inDEM, stages, refPlane, 1.0, "NUMPY")
+                for tolerance in [0.001, 0.01]:
+                    adaptive_vol, adaptive_area = stagelookup_adaptive.adaptive_volume_table(inDEM, stages, refPlane, 1.0,
+                                                                                             tolerance)
+                    self.assertTrue(abs(adaptive_vol - vol).max() <= tolerance + 1e-9, (refPlane, tolerance))
+                    self.assertTrue(abs(adaptive_area - area).max() <= tolerance + 1e-9, (refPlane, tolerance))
+        calls, evaluated = stagelookup_adaptive.STATS.take()
+        self.assertTrue(calls < evaluated)
+
+    def test_adaptive_without_statistics(self):
+        z = numpy.load(self.dems[0])
+        inDEM = os.path.join(self.out, "no_statistics.npy")
+        arcpy_standin.save_raster(inDEM, z, 1.0, statistics=False)
+        self.assertEqual(arcpy_standin.Raster(inDEM).minimum, None)
+        self.assertEqual(stagelookup_adaptive.elevation_range(inDEM, 0.01),
+                         (arcpy_standin.Raster(self.dems[0]).minimum, arcpy_standin.Raster(self.dems[0]).maximum))
+        vol, area = stagelookup_engine.volume_table(inDEM, self.stages, "BELOW", 1.0, "NUMPY")
+        adaptive_vol, adaptive_area = stagelookup_adaptive.adaptive_volume_table(inDEM, self.stages, "BELOW", 1.0, 0.001)
+        self.assertTrue(abs(adaptive_vol - vol).max() <= 0.001 + 1e-9)
+
+    def test_adaptive_with_out_of_date_statistics(self):
+        # Statistics of the DEM before its lowest and highest cells were edited in: 1 m inside the true range.
+        inDEM = os.path.join(self.out, "stale_statistics.npy")
+        arcpy_standin.save_raster(inDEM, numpy.load(self.dems[0]), 1.0)
+        f = open(inDEM + ".json", "r")
+        header = json.load(f)
+        f.close()
+        header["minimum"] += 1.0
+        header["maximum"] -= 1.0
+        f = open(inDEM + ".json", "w")
+        json.dump(header, f)
+        f.close()
+
+        for refPlane in ["BELOW", "ABOVE"]:
+            vol, area = stagelookup_engine.volume_table(inDEM, self.stages, refPlane, 1.0, "NUMPY")
+            adaptive_vol, adaptive_area = stagelookup_engine.volume_table(inDEM, self.stages, refPlane, 1.0, "ADAPTIVE",
+                                                                          tile_mb=0.01, tolerance=0.001)
+            self.assertTrue(abs(adaptive_vol - vol).max() <= 0.001 + 1e-9, refPlane)
+            self.assertTrue(abs(adaptive_area - area).max() <= 0.001 + 1e-9, refPlane)
+
+
+class QueryTest(StageLookupTestCase):
+
+    def tables(self, refPlane, incElev_feet):
+        stages = stagelookup_engine.stage_list(START_FEET, END_FEET, incElev_feet, 2)
+        tables = []
+        for parc_number, inDEM in enumerate(self.dems, 1):
+            vol, area = stagelookup_engine.volume_table(inDEM, stages, refPlane, 1.0)
+            tables.append((parc_number, stages, vol, area))
+        return tables
+
+    def test_coarse_table_answers_fine_queries(self):
+        for refPlane in ["BELOW", "ABOVE"]:
+            query = stagelookup_query.StageLookupQuery(self.tables(refPlane, INC_FEET))
+            for parc_number, stages, vol, area in self.tables(refPlane, 0.01):
+                query_vol, query_area = query.volume_area(parc_number, stages)
+                numpy.testing.assert_allclose(query_vol, vol, rtol=0, atol=QUERY_VOL)
+                numpy.testing.assert_allclose(query_area, area, rtol=0, atol=QUERY_AREA)
+
+    def test_stage_for_volume_inverts_volume(self):
+        stages = numpy.array(stagelookup_engine.stage_list(START_FEET, END_FEET, 0.01, 2))
+        for refPlane in ["BELOW", "ABOVE"]:
+            query = stagelookup_query.StageLookupQuery(self.tables(refPlane, INC_FEET))
+            for parc_number in range(1, PARCELS + 1):
+                vol, area = query.volume_area(parc_number, stages)
+                wet = area > 0                      # Where the volume changes with stage; flat stretches give their lowest stage.
+                numpy.testing.assert_allclose(query.stage_for_volume(parc_number, vol[wet]), stages[wet], rtol=0, atol=1e-9)
+
+    def test_stages_outside_table_are_clamped(self):
+        for refPlane in ["BELOW", "ABOVE"]:
+            query = stagelookup_query.StageLookupQuery(self.tables(refPlane, INC_FEET))
+            for parc_number in range(1, PARCELS + 1):
+                below, above = query.volume_area(parc_number, [START_FEET - 5.0, END_FEET + 5.0])
+                first, last  = query.volume_area(parc_number, [START_FEET, END_FEET])
+                numpy.testing.assert_array_equal(below, first)
+                numpy.testing.assert_array_equal(above, last)
+
+    def test_unknown_parcel_is_an_error(self):
+        query = stagelookup_query.StageLookupQuery(self.tables("BELOW", INC_FEET))
+        self.assertRaises(KeyError, query.volume, [1, PARCELS + 1], START_FEET)
+        self.assertRaises(KeyError, query.stage_for_volume, PARCELS + 1, 0.0)
+
+    def test_broadcast_query(self):
+        query = stagelookup_query.StageLookupQuery(self.tables("BELOW", INC_FEET))
+        parcels = numpy.arange(1, PARCELS + 1)[:, numpy.newaxis]
+        stages  = numpy.linspace(START_FEET, END_FEET, 7)[numpy.newaxis, :]
+        vol, area = query.volume_area(parcels, stages)
+        self.assertEqual(vol.shape, (PARCELS, 7))
+        self.assertEqual(area.shape, (PARCELS, 7))
+        for i in range(PARCELS):
+            numpy.testing.assert_array_equal(vol[i], query.volume(i + 1, stages[0]))
+            numpy.testing.assert_array_equal(area[i], query.area(i + 1, stages[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()